@@ -1,17 +1,62 @@
-import mlflow 
+import time
+# start of the API, to report how long it takes to be ready
+STARTED = time.perf_counter()
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 import pandas as pd 
 import numpy as np
 from pydantic import BaseModel
-from typing import Literal
-from fastapi import FastAPI, File, UploadFile
+from typing import List, Literal, Optional
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import Response, StreamingResponse
+
+from batching import MicroBatcher
+from cache import PredictionCache, bucket_mileage, canonical_key
+from bulk import check_file, predict_rows, predictions_csv, read_chunks
+from metrics import (BATCH_SIZE, ENCODE_SECONDS, PREDICT_SECONDS, STARTUP_SECONDS, VALIDATION_SECONDS,
+                     MetricsMiddleware, render)
+from model_store import ModelStore
+
+# Model served at startup, a run or registry URI (e.g. models:/xgbmodel/3)
+MODEL_URI = os.environ.get("MODEL_URI", 'runs:/42a196c5ca6745a8960e1a8f29ac311c/getaround_estimator')
+# Lite model directory (see price_predictor/train.py) served instead of MODEL_URI, without importing mlflow nor sklearn
+LITE_MODEL_PATH = os.environ.get("LITE_MODEL_PATH")
+# Seconds between checks of the registry for a new xgbmodel version, 0 disables polling
+MODEL_POLL_INTERVAL = float(os.environ.get("MODEL_POLL_INTERVAL", 0))
+# Rows predicted at once by /predict/file
+PREDICT_CHUNK_SIZE = int(os.environ.get("PREDICT_CHUNK_SIZE", 10000))
+# Micro-batching of concurrent /predict calls: window in milliseconds (0 disables it) and maximum rows per batch
+MICRO_BATCH_WAIT_MS = float(os.environ.get("MICRO_BATCH_WAIT_MS", 0))
+MICRO_BATCH_SIZE = int(os.environ.get("MICRO_BATCH_SIZE", 64))
+# Threads running the predictions of each worker process, so that the event loop keeps answering other requests
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", 4))
+# Threads used by XGBoost for one prediction call, 0 keeps the XGBoost default (all cores)
+XGBOOST_NTHREAD = int(os.environ.get("XGBOOST_NTHREAD", 1))
+# Cache of /predict results: number of cars kept (0 disables it), seconds they stay valid,
+# and width in km of the mileage buckets used with `approximate=true` (0 disables bucketing)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", 10000))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", 3600))
+CACHE_MILEAGE_BUCKET = int(os.environ.get("CACHE_MILEAGE_BUCKET", 1000))
 
 description = """
 This is a GetAround pricing prediction API
 
 ## Prediction Endpoint
 To obtain a prediction of the best pricing for your car:
-* `/predict`: accepts car specifications (see schema below) and returns a price prediction based on input data.
+* `/predict`: accepts car specifications (see schema below) and returns a price prediction based on input data. With `approximate=true`, the mileage is rounded to the middle of its bucket so that similar cars share cached predictions.
+* `/predict/batch`: accepts a list of car specifications and returns the list of their price predictions.
+* `/predict/file`: accepts a CSV or Parquet file with the columns of `get_around_pricing_project.csv` and streams back a CSV of `row,prediction`.
+
+## Model Management
+The model is loaded once at startup and kept in memory.
+* `/model`: returns the model currently served and how long the API took to start.
+* `/cache`: returns the size and hit/miss counters of the prediction cache, which is emptied when another model is loaded.
+
+## Monitoring
+* `/metrics`: request counts, errors, latencies per endpoint and per prediction stage, batch sizes and served model, in Prometheus text format.
+* `/reload`: loads a version of the registered `xgbmodel` (the latest one by default) and swaps it in without interrupting ongoing predictions.
 
 """
 
@@ -19,6 +64,12 @@ To obtain a prediction of the best pricing for your car:
 tags_metadata = [
     {
         "name": "Prediction Endpoint",
+    },
+    {
+        "name": "Model Management",
+    },
+    {
+        "name": "Monitoring",
     }
 ]
 
@@ -51,6 +102,112 @@ class PredictionInput(BaseModel):
     winter_tires: Literal[True, False] = False
 
 
+# Model input columns, in the order of the training data
+FEATURES = list(PredictionInput.__fields__)
+
+store = ModelStore(nthread=XGBOOST_NTHREAD)
+cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL)
+executor = None
+batcher = None
+
+
+def served_version():
+    current = store.current
+    return str(current.version) if current is not None else "none"
+
+
+app.add_middleware(MetricsMiddleware, model_version=served_version)
+
+
+def observe_validation(request):
+    # time from the request reaching the app to the endpoint: reading and validating the body
+    VALIDATION_SECONDS.observe(time.perf_counter() - request.scope["received_at"])
+
+
+def predict_frame(model, frame, source):
+    BATCH_SIZE.labels(source).observe(len(frame))
+    with PREDICT_SECONDS.time():
+        return model.predict(frame)
+
+
+def predict_fast(fast, car):
+    BATCH_SIZE.labels("single").observe(1)
+    with ENCODE_SECONDS.time():
+        row = fast.encode(car)
+    with PREDICT_SECONDS.time():
+        return fast.predict_encoded(row)
+
+
+startup_seconds = None
+
+
+@app.on_event("startup")
+def load_model():
+    global startup_seconds
+    if LITE_MODEL_PATH:
+        store.load_lite(LITE_MODEL_PATH)
+    else:
+        store.load(MODEL_URI)
+    if MODEL_POLL_INTERVAL > 0:
+        store.start_polling(MODEL_POLL_INTERVAL)
+    # from the import of the app to the model being ready to predict
+    startup_seconds = time.perf_counter() - STARTED
+    STARTUP_SECONDS.set(startup_seconds)
+    print(f"API ready in {startup_seconds:.2f}s ({'lite' if LITE_MODEL_PATH else 'mlflow'} model)")
+
+
+@app.on_event("startup")
+def start_executor():
+    global executor
+    executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+
+
+def predict_micro_batch(rows):
+    """Predict the rows of a micro-batch with the model served when the batch is sent."""
+    current = store.current
+    # Encode the rows straight into the booster input when the model was exported with its encoder
+    if current.fast is not None:
+        BATCH_SIZE.labels("micro_batch").observe(len(rows))
+        with ENCODE_SECONDS.time():
+            x = np.vstack([current.fast.encode(row) for row in rows])
+        with PREDICT_SECONDS.time():
+            return current.fast.booster.inplace_predict(x)
+    with ENCODE_SECONDS.time():
+        frame = pd.DataFrame(rows, columns=FEATURES)
+    return predict_frame(current.model, frame, "micro_batch")
+
+
+@app.on_event("startup")
+async def start_batcher():
+    global batcher
+    if MICRO_BATCH_WAIT_MS > 0:
+        # as many batches are predicted at once as there are inference threads
+        batcher = MicroBatcher(predict_micro_batch, max_batch_size=MICRO_BATCH_SIZE, max_wait_ms=MICRO_BATCH_WAIT_MS,
+                               executor=executor, max_concurrent=INFERENCE_THREADS)
+        batcher.start()
+
+
+@app.on_event("shutdown")
+def stop_model_polling():
+    store.stop_polling()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    if batcher is not None:
+        await batcher.stop()
+
+
+@app.on_event("shutdown")
+def stop_executor():
+    executor.shutdown(wait=True)
+
+
+async def run_inference(function, *args):
+    """Run a blocking prediction in the inference threads and wait for its result."""
+    return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+
 @app.get("/")
 async def index():
     message = "Welcome to the GetArond prediction API. Please check out the documentation of the api at `/docs`"
@@ -58,9 +215,40 @@ async def index():
 
 
 @app.post("/predict", tags=["Prediction Endpoint"])
-async def predict(PredictionInput: PredictionInput):
+async def predict(request: Request, PredictionInput: PredictionInput, approximate: bool = False):
+    observe_validation(request)
+
+    # Callers accepting an approximate price share the prediction of the middle of their mileage bucket
+    if approximate and CACHE_MILEAGE_BUCKET > 0:
+        PredictionInput = PredictionInput.copy(update={"mileage": bucket_mileage(PredictionInput.mileage, CACHE_MILEAGE_BUCKET)})
+
+    # Model loaded at startup, kept for the whole request even if a reload happens meanwhile
+    current = store.current
+
+    # Repeated car specifications are answered from the cache of the current model
+    key = canonical_key(PredictionInput.dict(), FEATURES)
+    prediction = cache.get(current.uri, key)
+    if prediction is None:
+        prediction = await predict_car(PredictionInput, current)
+        cache.put(current.uri, key, prediction)
+
+    # Format response
+    response = {"prediction": prediction}
+    return response
+
+
+async def predict_car(PredictionInput, current):
+
+    # Concurrent requests are predicted together when micro-batching is enabled
+    if batcher is not None:
+        return await batcher.submit(PredictionInput.dict())
+
+    # Encode the car straight into the booster input when the model was exported with its encoder
+    if current.fast is not None:
+        return await run_inference(predict_fast, current.fast, PredictionInput.dict())
 
     # Read input data 
+    encode_start = time.perf_counter()
     prediction_input = pd.DataFrame({"model_key": [PredictionInput.model_key],
     "mileage": [PredictionInput.mileage],
     "engine_power": [PredictionInput.engine_power],
@@ -75,20 +263,82 @@ async def predict(PredictionInput: PredictionInput):
     "has_speed_regulator": [PredictionInput.has_speed_regulator],
     "winter_tires": [PredictionInput.winter_tires]
     })
+    ENCODE_SECONDS.observe(time.perf_counter() - encode_start)
+
+    loaded_model = current.model
+
+    prediction = await run_inference(predict_frame, loaded_model, prediction_input, "single")
+    return prediction.tolist()[0]
+
 
-    # Log model from mlflow 
-    logged_model = 'runs:/42a196c5ca6745a8960e1a8f29ac311c/getaround_estimator'
+@app.post("/predict/batch", tags=["Prediction Endpoint"])
+async def predict_batch(request: Request, inputs: List[PredictionInput]):
+    observe_validation(request)
 
-    mlflow.pyfunc.get_model_dependencies(logged_model)
-    # Load model as a PyFuncModel.
-    loaded_model = mlflow.pyfunc.load_model(logged_model)
-    
-    prediction = loaded_model.predict(prediction_input)
+    # Nothing to predict, the model would reject an empty frame
+    if not inputs:
+        return {"predictions": []}
+
+    # Read input data, one row per car
+    with ENCODE_SECONDS.time():
+        prediction_input = pd.DataFrame([car.dict() for car in inputs], columns=FEATURES)
+
+    loaded_model = store.current.model
+    prediction = await run_inference(predict_frame, loaded_model, prediction_input, "batch")
 
     # Format response
-    response = {"prediction": prediction.tolist()[0]}
+    response = {"predictions": prediction.tolist()}
     return response
 
 
+@app.post("/predict/file", tags=["Prediction Endpoint"])
+def predict_file(file: UploadFile = File(...)):
+    # Errors in the format or the columns of the file are reported before streaming starts
+    try:
+        check_file(file, FEATURES)
+    except Exception as error:
+        raise HTTPException(status_code=422, detail=str(error))
+
+    # Rows the model rejects get an error instead of a prediction, the other rows are still predicted
+    loaded_model = store.current.model
+
+    def predict_chunk(frame):
+        # the file is read in Starlette's threads, its predictions share the inference threads with /predict
+        return executor.submit(predict_frame, loaded_model, frame, "file").result()
+
+    predicted_chunks = ((chunk, *predict_rows(predict_chunk, chunk))
+                        for chunk in read_chunks(file, FEATURES, PREDICT_CHUNK_SIZE))
+
+    return StreamingResponse(predictions_csv(predicted_chunks), media_type="text/csv",
+                             headers={"Content-Disposition": "attachment; filename=predictions.csv"})
+
+
+@app.get("/model", tags=["Model Management"])
+async def model_info():
+    current = store.current
+    return {"uri": current.uri, "version": current.version, "fast_encoder": current.fast is not None,
+            "lite": current.uri == LITE_MODEL_PATH, "startup_seconds": startup_seconds}
+
+
+@app.get("/cache", tags=["Model Management"])
+async def cache_stats():
+    return cache.stats()
+
+
+@app.post("/reload", tags=["Model Management"])
+def reload_model(version: Optional[int] = None):
+    try:
+        current = store.reload(version)
+    except Exception as error:
+        raise HTTPException(status_code=503, detail=f"Could not load model: {error}")
+    return {"uri": current.uri, "version": current.version, "fast_encoder": current.fast is not None}
+
+
+@app.get("/metrics", tags=["Monitoring"])
+def metrics():
+    content, content_type = render()
+    return Response(content, media_type=content_type)
+
+
 if __name__=="__main__":
     uvicorn.run(app, host="0.0.0.0", port=4000, debug=True, reload=True)
\ No newline at end of file
@@ -0,0 +1,104 @@
+import asyncio
+
+
+class MicroBatcher:
+    """Groups concurrent single-row predictions into one model call.
+
+    `predict(rows)` predicts a list of input rows (dicts of the model
+    columns) and returns one prediction per row. A request that finds the
+    queue empty waits at most `max_wait_ms` for others to join it; requests
+    already queued, e.g. because every inference thread was busy, are sent
+    at once, up to `max_batch_size` rows per batch. Up to `max_concurrent`
+    batches are predicted at the same time in `executor` (the default one if
+    None), so it should match the threads of the executor: while they are
+    all busy, new requests queue up and form the next batch. A larger window
+    or batch size raises throughput under load at the cost of latency.
+    """
+
+    def __init__(self, predict, max_batch_size=64, max_wait_ms=3, executor=None, max_concurrent=1):
+        self.predict = predict
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_concurrent = max_concurrent
+        self.queue = None
+        self.slots = None
+        self.task = None
+        self.running = set()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self.task, *self.running) if task is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, row):
+        """Queue one input row (a dict of the model columns) and return its prediction."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        if len(batch) > 1:
+            # requests were waiting already, waiting longer would only delay them
+            return batch
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # a batch is only collected when a thread is free to predict it
+            await self.slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self.slots.release()
+                raise
+            task = loop.create_task(self._send(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _send(self, batch):
+        try:
+            await self._predict(batch)
+        finally:
+            self.slots.release()
+
+    async def _predict(self, batch):
+        try:
+            predictions = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.predict, [row for row, _ in batch])
+        except Exception as error:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(error)
+                return
+            # a row the model rejects only fails its own request
+            for item in batch:
+                await self._predict([item])
+            return
+        for (_, future), prediction in zip(batch, predictions):
+            if not future.done():
+                future.set_result(float(prediction))
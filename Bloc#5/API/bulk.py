@@ -0,0 +1,111 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def file_format(upload):
+    """Return `csv` or `parquet` from the name or content type of an uploaded file."""
+    name = (upload.filename or "").lower()
+    content_type = (upload.content_type or "").lower()
+    if name.endswith((".parquet", ".pq")) or "parquet" in content_type:
+        return "parquet"
+    if name.endswith(".csv") or "csv" in content_type:
+        return "csv"
+    raise ValueError("Upload a .csv or .parquet file")
+
+
+def read_chunks(upload, features, chunk_size=10000):
+    """Yield the `features` columns of an uploaded CSV or Parquet file, `chunk_size` rows at a time.
+
+    Files in the get_around_pricing_project.csv schema are accepted as they
+    are: extra columns such as the unnamed index or `rental_price_per_day`
+    are ignored.
+    """
+    fmt = file_format(upload)
+    if fmt == "csv":
+        reader = pd.read_csv(upload.file, chunksize=chunk_size, usecols=lambda column: column in features)
+        for chunk in reader:
+            yield check_columns(chunk, features)
+    else:
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(upload.file)
+        missing = [column for column in features if column not in parquet.schema_arrow.names]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=features):
+            yield batch.to_pandas()
+
+
+def check_file(upload, features):
+    """Check the format and the columns of an uploaded file before any prediction is streamed.
+
+    Only the CSV header or the Parquet footer is read; errors further in the
+    file end the streamed predictions with an error row (see `predictions_csv`).
+    """
+    fmt = file_format(upload)
+    if fmt == "csv":
+        check_columns(pd.read_csv(upload.file, nrows=0, usecols=lambda column: column in features), features)
+    else:
+        import pyarrow.parquet as pq
+
+        names = pq.ParquetFile(upload.file).schema_arrow.names
+        missing = [column for column in features if column not in names]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+    upload.file.seek(0)
+
+
+def predict_rows(predict, chunk):
+    """Return the predictions of a chunk and the error of each row, NaN and None for the rows predicted.
+
+    When the model rejects the chunk, e.g. for a category it has never seen,
+    the chunk is split in halves until the rows it rejects are isolated: a
+    bad row costs a few model calls instead of failing the whole file.
+    """
+    try:
+        return np.asarray(predict(chunk), dtype=float), [None] * len(chunk)
+    except Exception as error:
+        if len(chunk) == 1:
+            return np.array([np.nan]), [str(error).splitlines()[0] if str(error) else type(error).__name__]
+    middle = len(chunk) // 2
+    left, left_errors = predict_rows(predict, chunk.iloc[:middle])
+    right, right_errors = predict_rows(predict, chunk.iloc[middle:])
+    return np.concatenate([left, right]), left_errors + right_errors
+
+
+def check_columns(chunk, features):
+    missing = [column for column in features if column not in chunk.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return chunk[features]
+
+
+def predictions_csv(predicted_chunks):
+    """Yield CSV text with the row number, prediction and error of every row from `(chunk, predictions, errors)` triples.
+
+    Rows the model rejected have an empty prediction and the reason in `error`.
+    When the file cannot be read further, a last row numbered after the rows
+    read has the read error and the stream ends.
+    """
+    yield "row,prediction,error\n"
+    row = 0
+    predicted_chunks = iter(predicted_chunks)
+    while True:
+        try:
+            chunk, predictions, errors = next(predicted_chunks)
+        except StopIteration:
+            return
+        except Exception as error:
+            # the headers are already sent, the error can only be reported in the CSV
+            yield csv_rows(row, [np.nan], [f"Cannot read the file: {str(error).splitlines()[0] if str(error) else type(error).__name__}"])
+            return
+        yield csv_rows(row, predictions, errors)
+        row += len(chunk)
+
+
+def csv_rows(row, predictions, errors):
+    out = io.StringIO()
+    pd.DataFrame({"row": range(row, row + len(predictions)), "prediction": predictions, "error": errors}).to_csv(out, index=False, header=False)
+    return out.getvalue()
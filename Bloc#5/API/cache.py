@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_key(car, features):
+    """Return a hashable key of the input values of a car, in the order of the model columns."""
+    return tuple(car[feature] for feature in features)
+
+
+def bucket_mileage(mileage, bucket):
+    """Round `mileage` to the middle of its `bucket` km wide bucket."""
+    return (mileage // bucket) * bucket + bucket // 2
+
+
+class PredictionCache:
+    """LRU cache of predictions with a time to live, for the model being served.
+
+    Entries are stored for one model at a time: looking up or storing a
+    prediction for another model (after a reload) empties the cache, so a
+    prediction of a previous version is never returned. A `max_size` of 0
+    disables the cache.
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.model = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _use_model(self, model):
+        if model != self.model:
+            self.entries.clear()
+            self.model = model
+
+    def get(self, model, key):
+        """Return the cached prediction of `key` for `model`, or None."""
+        if not self.max_size:
+            return None
+        with self._lock:
+            self._use_model(model)
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, model, key, prediction):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._use_model(model)
+            self.entries[key] = (prediction, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model": self.model,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,174 @@
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Layout version of the lite model directories written by price_predictor/train.py
+LITE_FORMAT = 1
+
+
+class FastEncoder:
+    """Encodes one car into the model input row without pandas nor sklearn.
+
+    `layout` is the `encoder.json` logged by price_predictor/train.py: the
+    columns are the scaled numeric features followed by the one-hot encoded
+    categorical features, without their dropped category, as produced by the
+    ColumnTransformer of the training pipeline. The row is then predicted by
+    the XGBoost booster of that pipeline.
+    """
+
+    def __init__(self, layout, booster):
+        self.booster = booster
+        self.numeric_features = layout["numeric_features"]
+        self.mean = np.asarray(layout["mean"], dtype=np.float64)
+        self.scale = np.asarray(layout["scale"], dtype=np.float64)
+        self.categorical_features = layout["categorical_features"]
+        self.sparse = layout["sparse"]
+
+        # column of every kept category, per categorical feature
+        self.columns = []
+        offset = len(self.numeric_features)
+        for categories, drop in zip(layout["categories"], layout["drop"]):
+            kept = [category for i, category in enumerate(categories) if i != drop]
+            self.columns.append({category: offset + i for i, category in enumerate(kept)})
+            offset += len(kept)
+        self.categories = [set(categories) for categories in layout["categories"]]
+        self.width = offset
+
+    def encode(self, row):
+        """Return the float32 model input of `row`, a dict of the input columns."""
+        x = np.zeros(self.width, dtype=np.float32)
+        for i, feature in enumerate(self.numeric_features):
+            x[i] = (row[feature] - self.mean[i]) / self.scale[i]
+        for feature, columns, categories in zip(self.categorical_features, self.columns, self.categories):
+            value = row[feature]
+            if value not in categories:
+                raise ValueError(f"Unknown category {value!r} for {feature}")
+            # the dropped category has no column
+            if value in columns:
+                x[columns[value]] = 1
+        if self.sparse:
+            # zeros are not stored in the sparse matrix of the pipeline, XGBoost reads them as missing
+            x[x == 0] = np.nan
+        return x
+
+    def encode_frame(self, frame):
+        """Return the float32 model input of the rows of a DataFrame of the input columns."""
+        x = np.zeros((len(frame), self.width), dtype=np.float32)
+        x[:, :len(self.numeric_features)] = (frame[self.numeric_features].to_numpy(np.float64) - self.mean) / self.scale
+        rows = np.arange(len(frame))
+        for feature, columns, categories in zip(self.categorical_features, self.columns, self.categories):
+            values = frame[feature]
+            unknown = ~values.isin(categories)
+            if unknown.any():
+                raise ValueError(f"Unknown categories {sorted(set(values[unknown]), key=str)} for {feature}")
+            # NaN for the dropped category, which has no column
+            positions = values.map(columns).to_numpy(np.float64)
+            kept = ~np.isnan(positions)
+            x[rows[kept], positions[kept].astype(np.intp)] = 1
+        if self.sparse:
+            x[x == 0] = np.nan
+        return x
+
+    def predict(self, row):
+        return self.predict_encoded(self.encode(row))
+
+    def predict_encoded(self, x):
+        return float(self.booster.inplace_predict(x[None, :])[0])
+
+    @classmethod
+    def from_pyfunc(cls, loaded_model):
+        """Build the encoder of a model loaded with `mlflow.pyfunc.load_model`.
+
+        Returns None when the run has no `encoder.json` (models trained before
+        it was logged) or the model is not the sklearn pipeline of train.py.
+        """
+        import mlflow
+
+        try:
+            layout = mlflow.artifacts.load_dict(f"runs:/{loaded_model.metadata.run_id}/encoder.json")
+            pipeline = sklearn_pipeline(loaded_model)
+            booster = pipeline.named_steps["Model"].get_booster()
+        except Exception as error:
+            logger.info("No fast encoder for this model: %s", error)
+            return None
+        return cls(layout, booster)
+
+
+class LiteModel:
+    """Model of a lite model directory, with the `predict(frame)` method of the MLflow models."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def predict(self, frame):
+        return self.encoder.booster.inplace_predict(self.encoder.encode_frame(frame))
+
+
+def load_lite_model(path):
+    """Load a lite model directory written by price_predictor/train.py.
+
+    Returns its `meta.json` and its FastEncoder. Only numpy and xgboost are
+    imported, so that the API starts without mlflow nor sklearn.
+    """
+    import xgboost
+
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != LITE_FORMAT:
+        raise ValueError(f"Lite model format {meta.get('format')} is not supported, expected {LITE_FORMAT}")
+    with open(os.path.join(path, "encoder.json")) as f:
+        layout = json.load(f)
+    booster = xgboost.Booster()
+    booster.load_model(os.path.join(path, "model.ubj"))
+    return meta, FastEncoder(layout, booster)
+
+
+def sklearn_pipeline(loaded_model):
+    if hasattr(loaded_model, "get_raw_model"):
+        return loaded_model.get_raw_model()
+    impl = loaded_model._model_impl
+    return getattr(impl, "sklearn_model", impl)
+
+
+def check_parity(loaded_model, data, rows=1000, encoder=None):
+    """Return the largest difference between the fast path and the full pipeline on `rows` rows of `data`.
+
+    Both the single row and the DataFrame encodings are compared, with the
+    encoder of the model or the given `encoder` (e.g. of a lite model).
+    """
+    encoder = encoder or FastEncoder.from_pyfunc(loaded_model)
+    if encoder is None:
+        raise LookupError("The model has no encoder.json, retrain it with price_predictor/train.py")
+    # rows of categories unknown to the model (e.g. only found in outliers) fail on both paths
+    known = np.all([data[feature].isin(categories)
+                    for feature, categories in zip(encoder.categorical_features, encoder.categories)], axis=0)
+    sample = data[known].iloc[:rows]
+    expected = loaded_model.predict(sample)
+    fast = np.array([encoder.predict(row) for row in sample.to_dict("records")])
+    frame = LiteModel(encoder).predict(sample)
+    return float(max(np.max(np.abs(fast - expected)), np.max(np.abs(frame - expected))))
+
+
+if __name__ == "__main__":
+    import mlflow
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Compare the fast encoder with the full pipeline of a model.")
+    parser.add_argument("model_uri", help="run or registry URI of the model, e.g. models:/xgbmodel/3")
+    parser.add_argument("--data", default="../price_predictor/get_around_pricing_project.csv")
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    parser.add_argument("--lite", default=None, help="lite model directory of the same run to check instead")
+    args = parser.parse_args()
+
+    data = pd.read_csv(args.data, index_col=[0]).iloc[:, 0:13]
+    encoder = load_lite_model(args.lite)[1] if args.lite else None
+    difference = check_parity(mlflow.pyfunc.load_model(args.model_uri), data, args.rows, encoder)
+    print(f"Largest difference: {difference:.6f}")
+    if difference > args.tolerance:
+        raise SystemExit(f"Fast encoder differs from the pipeline by more than {args.tolerance}")
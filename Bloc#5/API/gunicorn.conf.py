@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+# Every worker is a separate process that loads the model once at startup,
+# predictions then run in its INFERENCE_THREADS threads (see app.py)
+bind = f"0.0.0.0:{os.environ.get('PORT', 4000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+# loading the model can take a while when it is downloaded from the registry
+timeout = int(os.environ.get("WORKER_TIMEOUT", 120))
+
+
+def child_exit(server, worker):
+    # drop the metrics of a stopped worker when they are shared between workers (see metrics.py)
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
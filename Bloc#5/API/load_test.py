@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+PREDICTOR_DIR = os.path.join(API_DIR, "..", "price_predictor")
+
+sys.path.insert(0, PREDICTOR_DIR)
+from dataset import load_dataset
+from train import build_model, categorical_features, encoder_layout, numeric_features, remove_outliers, save_lite_model
+
+# request mixes: which endpoint is called and with which cars
+# single: /predict with a random car of the dataset
+# repeated: /predict with one of a few cars, as when callers ask for the same configurations
+# batch: /predict/batch with `batch_size` random cars
+MIXES = ("single", "repeated", "batch")
+
+
+def train_local_model(tracking_uri, n_estimators=100, lite_path=None):
+    """Train the pricing pipeline on the bundled dataset and register it as xgbmodel in `tracking_uri`.
+
+    Returns the registry URI of the new version. The lite model is also
+    written to `lite_path` when given.
+    """
+    import mlflow
+    from mlflow.models.signature import infer_signature
+
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment("load-test")
+    df_clean = remove_outliers(load_dataset())
+    Y = df_clean.loc[:, 'rental_price_per_day']
+    X = df_clean.iloc[:, 0:13]
+
+    model = build_model(n_estimators=n_estimators)
+    with mlflow.start_run():
+        model.fit(X, Y)
+        info = mlflow.sklearn.log_model(
+            sk_model=model,
+            artifact_path="getaround_estimator",
+            registered_model_name="xgbmodel",
+            signature=infer_signature(X, model.predict(X)),
+            serialization_format="cloudpickle",
+        )
+        layout = encoder_layout(model, numeric_features, categorical_features)
+        mlflow.log_dict(layout, "encoder.json")
+        if lite_path:
+            save_lite_model(model.named_steps["Model"].get_booster(), layout, lite_path, model_name="xgbmodel",
+                            model_version=info.registered_model_version)
+    return f"models:/xgbmodel/{info.registered_model_version}"
+
+
+def start_server(env, port, workers):
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(workers),
+               "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=API_DIR, env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The API stopped while starting")
+        try:
+            response = httpx.get(f"http://127.0.0.1:{port}/model")
+            if response.status_code == 200:
+                return server, response.json()["startup_seconds"]
+        except httpx.TransportError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError("The API did not start within 2 minutes")
+
+
+def load_cars():
+    # cars of the training data only: categories found only in outliers are unknown to the model
+    df = remove_outliers(load_dataset()).iloc[:, 0:13]
+    return json.loads(df.to_json(orient="records"))
+
+
+def make_requests(mix, cars, n, batch_size, seed=0):
+    """Return `n` (path, payload) pairs of the given request mix."""
+    rng = random.Random(seed)
+    if mix == "single":
+        return [("/predict", rng.choice(cars)) for _ in range(n)]
+    if mix == "repeated":
+        few = rng.sample(cars, 10)
+        return [("/predict", rng.choice(few)) for _ in range(n)]
+    return [("/predict/batch", rng.sample(cars, batch_size)) for _ in range(n)]
+
+
+async def drive(base_url, requests, concurrency):
+    """Send `requests` with `concurrency` clients in parallel and return their latencies and errors."""
+    latencies = []
+    errors = 0
+    queue = iter(requests)
+
+    async def client(http):
+        nonlocal errors
+        for path, payload in queue:
+            start = time.perf_counter()
+            try:
+                response = await http.post(path, json=payload)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def summarize(latencies, errors, elapsed, rows_per_request):
+    latencies = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "rows_per_second": round(len(latencies) * rows_per_request / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, cwd=API_DIR).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the pricing API with a model trained locally.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="parallel clients")
+    parser.add_argument("--mixes", nargs="+", choices=MIXES, default=list(MIXES))
+    parser.add_argument("--requests", type=int, default=2000, help="requests per mix and concurrency")
+    parser.add_argument("--warmup", type=int, default=100, help="requests sent before each measure")
+    parser.add_argument("--batch-size", type=int, default=50, help="cars per /predict/batch request")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--n-estimators", type=int, default=100, help="trees of the local model")
+    parser.add_argument("--lite", action="store_true", help="serve the lite model instead of the MLflow one")
+    parser.add_argument("--port", type=int, default=4100)
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="settings of the API, e.g. MICRO_BATCH_WAIT_MS=3 PREDICTION_CACHE_SIZE=0")
+    parser.add_argument("--out", default="load_test_results.jsonl",
+                        help="results are appended to this JSON lines file to compare versions")
+    args = parser.parse_args()
+    args.out = os.path.abspath(args.out)
+
+    workdir = tempfile.mkdtemp(prefix="pricing_load_test_")
+    tracking_uri = f"sqlite:///{os.path.join(workdir, 'mlflow.db')}"
+    env = dict(os.environ, MLFLOW_TRACKING_URI=tracking_uri, PYTHONUNBUFFERED="1")
+    env.update(setting.split("=", 1) for setting in args.env)
+
+    results = {}
+    server = None
+    startup_seconds = None
+    try:
+        print("training model...")
+        # artifacts go to the working directory of the run, i.e. the temporary directory
+        os.chdir(workdir)
+        lite_path = os.path.join(workdir, "lite_model") if args.lite else None
+        env["MODEL_URI"] = train_local_model(tracking_uri, args.n_estimators, lite_path)
+        if lite_path:
+            env["LITE_MODEL_PATH"] = lite_path
+        server, startup_seconds = start_server(env, args.port, args.workers)
+
+        cars = load_cars()
+        base_url = f"http://127.0.0.1:{args.port}"
+        for mix in args.mixes:
+            rows = args.batch_size if mix == "batch" else 1
+            for concurrency in args.concurrency:
+                asyncio.run(drive(base_url, make_requests(mix, cars, args.warmup, args.batch_size, seed=1), concurrency))
+                latencies, errors, elapsed = asyncio.run(
+                    drive(base_url, make_requests(mix, cars, args.requests, args.batch_size), concurrency))
+                results[f"{mix}@{concurrency}"] = summarize(latencies, errors, elapsed, rows)
+                print(f"{mix:<9} x{concurrency:<4} " + " ".join(f"{name}={value}" for name, value in results[f"{mix}@{concurrency}"].items()))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        os.chdir(API_DIR)
+        shutil.rmtree(workdir)
+
+    record = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpus": os.cpu_count(),
+        "settings": vars(args),
+        "startup_seconds": startup_seconds,
+        "results": results,
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(record) + "\n")
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+# Stages of a prediction:
+# validation: from the request reaching the app to the endpoint, i.e. reading the body and validating it
+# encode: building the model input (DataFrame or NumPy row)
+# model_load: loading a model from MLflow
+# predict: running the model on the input
+STAGES = ("validation", "encode", "model_load", "predict")
+
+# prediction latencies go from tens of microseconds (fast encoder) to seconds (large files)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096, 10000, 100000)
+
+REQUESTS = Counter("pricing_requests_total", "Requests answered, by endpoint, status code and model version",
+                   ["endpoint", "status", "model_version"])
+ERRORS = Counter("pricing_errors_total", "Requests answered with an error status or an exception, by endpoint",
+                 ["endpoint", "status"])
+REQUEST_SECONDS = Histogram("pricing_request_seconds", "Time to answer a request, by endpoint",
+                            ["endpoint"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("pricing_stage_seconds", "Time spent in each stage of the predictions",
+                          ["stage"], buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("pricing_batch_rows", "Rows predicted per model call, by source",
+                       ["source"], buckets=BATCH_BUCKETS)
+STARTUP_SECONDS = Gauge("pricing_startup_seconds", "Time from the import of the app to the model being loaded",
+                        multiprocess_mode="liveall")
+MODEL_INFO = Gauge("pricing_model_info", "Model currently served (value 1)", ["uri", "version"],
+                   multiprocess_mode="liveall")
+
+# children are looked up once, labels() costs more than the observation itself
+VALIDATION_SECONDS, ENCODE_SECONDS, MODEL_LOAD_SECONDS, PREDICT_SECONDS = (STAGE_SECONDS.labels(stage) for stage in STAGES)
+
+
+# labels of the model exported as served by this process
+_served = None
+_served_lock = threading.Lock()
+
+
+def set_model(uri, version):
+    """Export `uri` and `version` as the model served, and the previous one as no longer served (value 0).
+
+    The previous series is set to 0 rather than removed: `clear()` does not
+    reach the files the values are kept in with PROMETHEUS_MULTIPROC_DIR.
+    """
+    global _served
+    labels = (uri, str(version))
+    with _served_lock:
+        if _served is not None and _served != labels:
+            MODEL_INFO.labels(*_served).set(0)
+        MODEL_INFO.labels(*labels).set(1)
+        _served = labels
+
+
+def render():
+    """Return the Prometheus text of the metrics and its content type.
+
+    With several gunicorn workers, PROMETHEUS_MULTIPROC_DIR must point to an
+    empty directory shared by the workers so that the metrics of all of them
+    are aggregated, whichever worker answers the scrape.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing every request.
+
+    It stores the time the request reached the app in the scope as
+    `received_at`, from which the endpoints measure the validation stage.
+    `model_version` returns the version label of the model being served.
+    Being a plain ASGI middleware it adds a few microseconds per request.
+    """
+
+    def __init__(self, app, model_version):
+        self.app = app
+        self.model_version = model_version
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        scope["received_at"] = start = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        except Exception:
+            status = 500
+            raise
+        finally:
+            # label with the route template so that ids in paths do not create new series
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or getattr(scope.get("endpoint"), "__name__", "other")
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, str(status), self.model_version()).inc()
+            if status >= 400:
+                ERRORS.labels(endpoint, str(status)).inc()
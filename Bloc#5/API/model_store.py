@@ -0,0 +1,110 @@
+import logging
+import threading
+from collections import namedtuple
+
+from fast_encoder import FastEncoder, LiteModel, load_lite_model, sklearn_pipeline
+from metrics import MODEL_LOAD_SECONDS, set_model
+
+logger = logging.getLogger(__name__)
+
+# Name of the pricing model in the MLflow model registry (see price_predictor/train.py)
+MODEL_NAME = "xgbmodel"
+
+# `fast` is the FastEncoder of the model, None when it has no encoder.json
+LoadedModel = namedtuple("LoadedModel", ["uri", "version", "model", "fast"])
+
+
+def limit_threads(model, nthread):
+    """Make the XGBoost booster of a loaded pipeline predict with `nthread` threads.
+
+    Predictions already run in parallel in the inference threads of every
+    worker, letting each of them use all cores as well would oversubscribe
+    the CPU.
+    """
+    try:
+        sklearn_pipeline(model).named_steps["Model"].get_booster().set_param({"nthread": nthread})
+    except Exception as error:
+        logger.info("Could not set the XGBoost threads: %s", error)
+
+
+class ModelStore:
+    """Keeps the pricing model in memory and swaps in new registry versions.
+
+    Requests read `store.current` once and keep using that model until they
+    finish; a reload builds the new model on the side and then replaces the
+    reference, so in-flight requests are never dropped nor served by a
+    half-loaded model.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, nthread=0):
+        self.model_name = model_name
+        self.nthread = nthread
+        self.current = None
+        self._load_lock = threading.Lock()
+        self._poller = None
+        self._stop = threading.Event()
+
+    def load(self, model_uri, version=None):
+        prefix = f"models:/{self.model_name}/"
+        if version is None and model_uri.startswith(prefix) and model_uri[len(prefix):].isdigit():
+            version = int(model_uri[len(prefix):])
+        # imported here so that lite models are served without importing mlflow
+        import mlflow
+
+        with self._load_lock:
+            with MODEL_LOAD_SECONDS.time():
+                model = mlflow.pyfunc.load_model(model_uri)
+                if self.nthread:
+                    limit_threads(model, self.nthread)
+                fast = FastEncoder.from_pyfunc(model)
+            self.current = LoadedModel(model_uri, version, model, fast)
+            set_model(model_uri, version)
+            logger.info("Loaded model %s", model_uri)
+            return self.current
+
+    def load_lite(self, path):
+        """Load a lite model directory (see price_predictor/train.py), without mlflow nor sklearn."""
+        with self._load_lock:
+            with MODEL_LOAD_SECONDS.time():
+                meta, fast = load_lite_model(path)
+                if self.nthread:
+                    fast.booster.set_param({"nthread": self.nthread})
+            version = meta.get("model_version")
+            self.current = LoadedModel(path, version, LiteModel(fast), fast)
+            set_model(path, version)
+            logger.info("Loaded lite model %s (run %s)", path, meta.get("run_id"))
+            return self.current
+
+    def latest_version(self):
+        import mlflow
+
+        client = mlflow.tracking.MlflowClient()
+        versions = client.search_model_versions(f"name='{self.model_name}'")
+        if not versions:
+            raise LookupError(f"No registered version of model {self.model_name}")
+        return max(int(version.version) for version in versions)
+
+    def reload(self, version=None):
+        """Load `version` of the registered model, or the latest one if None.
+
+        Nothing is loaded when that version is already being served.
+        """
+        version = int(version) if version is not None else self.latest_version()
+        if self.current is not None and self.current.version == version:
+            return self.current
+        return self.load(f"models:/{self.model_name}/{version}", version)
+
+    def start_polling(self, interval):
+        """Check the registry every `interval` seconds and load new versions."""
+        def poll():
+            while not self._stop.wait(interval):
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception("Could not reload model %s", self.model_name)
+
+        self._poller = threading.Thread(target=poll, name="model-poller", daemon=True)
+        self._poller.start()
+
+    def stop_polling(self):
+        self._stop.set()
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(API_DIR, "..", "price_predictor"))
+
+import train
+from dataset import LOCAL_CSV
+from fast_encoder import FastEncoder, LiteModel
+
+
+@pytest.fixture(scope="module")
+def data():
+    df = pd.read_csv(LOCAL_CSV, index_col=[0]).iloc[:1000]
+    return df.iloc[:, 0:13], df["rental_price_per_day"]
+
+
+# the ColumnTransformer outputs a sparse matrix when the one-hot columns are sparse enough,
+# XGBoost then reads its zeros as missing values
+@pytest.mark.parametrize("sparse", [True, False])
+def test_fast_encoder_matches_pipeline(data, sparse):
+    X, Y = data
+    model = train.build_model(n_estimators=20)
+    model.set_params(Preprocessing__sparse_threshold=1 if sparse else 0)
+    model.fit(X, Y)
+    layout = train.encoder_layout(model, train.numeric_features, train.categorical_features)
+    assert layout["sparse"] == sparse
+
+    encoder = FastEncoder(layout, model.named_steps["Model"].get_booster())
+    expected = model.predict(X)
+    rows = X.to_dict("records")
+
+    encoded = np.array([encoder.encode(row) for row in rows])
+    np.testing.assert_array_equal(np.isnan(encoded), np.isnan(encoder.encode_frame(X)))
+    assert np.isnan(encoded).any() == sparse
+
+    np.testing.assert_allclose([encoder.predict(row) for row in rows], expected, atol=1e-4)
+    np.testing.assert_allclose(LiteModel(encoder).predict(X), expected, atol=1e-4)
+
+
+def test_fast_encoder_rejects_unknown_category(data):
+    X, Y = data
+    model = train.build_model(n_estimators=5).fit(X, Y)
+    layout = train.encoder_layout(model, train.numeric_features, train.categorical_features)
+    encoder = FastEncoder(layout, model.named_steps["Model"].get_booster())
+    row = dict(X.iloc[0], fuel="hydrogen")
+    with pytest.raises(ValueError):
+        encoder.encode(row)
+    with pytest.raises(ValueError):
+        encoder.encode_frame(pd.DataFrame([row]))
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+from prometheus_client.parser import text_string_to_metric_families
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# hot-swap of the model in a worker, then scrape of the metrics shared by the workers
+SWAP = """
+import metrics
+metrics.set_model("models:/xgbmodel/1", 1)
+metrics.set_model("models:/xgbmodel/2", 2)
+print(metrics.render()[0].decode())
+"""
+
+
+def model_info(text):
+    return {sample.labels["version"]: sample.value
+            for family in text_string_to_metric_families(text) if family.name == "pricing_model_info"
+            for sample in family.samples}
+
+
+def test_model_info_after_reload_in_multiprocess_mode(tmp_path):
+    # the multiprocess mode is chosen when prometheus_client is imported, hence the new interpreter
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    output = subprocess.run([sys.executable, "-c", SWAP], cwd=API_DIR, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    assert model_info(output) == {"1": 0, "2": 1}
+
+
+def test_model_info_after_reload():
+    env = {name: value for name, value in os.environ.items() if name != "PROMETHEUS_MULTIPROC_DIR"}
+    output = subprocess.run([sys.executable, "-c", SWAP], cwd=API_DIR, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    assert model_info(output)["2"] == 1
+    assert model_info(output).get("1", 0) == 0
@@ -0,0 +1,89 @@
+import argparse
+import hashlib
+import os
+import shutil
+import time
+import urllib.request
+
+import pandas as pd
+
+DATA_URL = "https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx"
+# copy of the workbook bundled with the dashboard, downloaded from DATA_URL when missing
+LOCAL_XLSX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "get_around_delay_analysis.xlsx")
+# Parquet copies of the workbook, named after the checksum of the workbook they come from
+CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join(os.path.dirname(LOCAL_XLSX), ".cache"))
+
+# compact dtypes of the columns: categories for the text columns, nullable integers for the
+# ids and minutes (whole numbers, missing when there is no previous rental or no checkout)
+DTYPES = {
+    "rental_id": "int32",
+    "car_id": "int32",
+    "checkin_type": "category",
+    "state": "category",
+    "delay_at_checkout_in_minutes": "Int32",
+    "previous_ended_rental_id": "Int32",
+    "time_delta_with_previous_rental_in_minutes": "Int16",
+}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fetch_xlsx(path=LOCAL_XLSX, url=DATA_URL):
+    """Return `path`, downloading the workbook from `url` first if it is missing."""
+    if not os.path.exists(path):
+        print(f"downloading {url}...")
+        tmp_path = path + ".part"
+        with urllib.request.urlopen(url) as response, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(response, f)
+        os.replace(tmp_path, path)
+    return path
+
+
+def cache_path(sha256, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"get_around_delay_analysis-{sha256[:16]}.parquet")
+
+
+def load_dataset(path=LOCAL_XLSX, cache_dir=CACHE_DIR):
+    """Return the GetAround delay analysis data as a DataFrame with compact dtypes.
+
+    The first call reads the workbook (see `fetch_xlsx`) and converts it to
+    a Parquet file in `cache_dir`; later calls read that file. A modified
+    workbook has another checksum, hence another cache file.
+    """
+    path = fetch_xlsx(path)
+    cached = cache_path(file_sha256(path), cache_dir)
+    if os.path.exists(cached):
+        return pd.read_parquet(cached)
+
+    data = pd.read_excel(path).astype(DTYPES)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cached + ".part"
+    data.to_parquet(tmp_path)
+    os.replace(tmp_path, cached)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the Parquet cache of the delay analysis workbook.")
+    parser.add_argument("--compare", action="store_true", help="compare the load time and memory with the workbook")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = load_dataset()
+    print(f"{len(data)} rows loaded in {time.perf_counter() - start:.3f}s from {cache_path(file_sha256(LOCAL_XLSX))}")
+
+    if args.compare:
+        start = time.perf_counter()
+        data = load_dataset()
+        cached = time.perf_counter() - start, data.memory_usage(deep=True).sum()
+        start = time.perf_counter()
+        data = pd.read_excel(LOCAL_XLSX)
+        xlsx = time.perf_counter() - start, data.memory_usage(deep=True).sum()
+        print(f"parquet cache: {cached[0]*1000:.1f} ms, {cached[1]/1e6:.2f} MB")
+        print(f"workbook:      {xlsx[0]*1000:.1f} ms, {xlsx[1]/1e6:.2f} MB")
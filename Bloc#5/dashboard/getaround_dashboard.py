@@ -1,9 +1,11 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px 
 import plotly.io as pio
 import plotly.graph_objects as go
-import numpy as np
+import os
+
+from dataset import LOCAL_XLSX, load_dataset
+from rental_analysis import delay_labels, next_rental_delays, previous_rental_ids, threshold_curve, threshold_shares
 
 ### Config
 st.set_page_config(
@@ -13,17 +15,25 @@ st.set_page_config(
 )
 
 ### Data upload
-DATA_URL = ("https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_delay_analysis.xlsx")
-
-@st.cache
-def load_data():
-    data = pd.read_excel(DATA_URL)
+# the data is read from the Parquet cache of the bundled workbook, see dataset.py
+# one copy is shared by all the sessions and only reloaded when the workbook changes
+@st.cache_resource
+def load_data(modified):
+    data = load_dataset()
     return data
 
-data = load_data()
+def workbook_modified():
+    return os.path.getmtime(LOCAL_XLSX) if os.path.exists(LOCAL_XLSX) else None
+
+data = load_data(workbook_modified())
 # Selecting data with delay info
 data_complete = data.loc[data["time_delta_with_previous_rental_in_minutes"].notna(),:]
 
+# Shares of the rentals affected by every threshold, computed once per dataset
+@st.cache_data
+def load_threshold_curve(state, modified):
+    return threshold_curve(data_complete.loc[data_complete['state']==state,:])
+
 ### Setting personalised palette
 purples = ['#F6E5F5', '#CA6EC3', '#C04FB8', '#B01AA7', '#8D1586', '#5F1159']
 pio.templates["purples"] = go.layout.Template(
@@ -96,7 +106,7 @@ fig.update_layout(
 st.plotly_chart(fig, use_container_width=True)
 
 plot_data=data_complete.loc[data["state"]=="ended",:]
-plot_data['delay'] = plot_data['delay_at_checkout_in_minutes'].map(lambda x: "On time" if (x<=0 or np.isnan(x)) else "Delayed")
+plot_data['delay'] = delay_labels(plot_data['delay_at_checkout_in_minutes'])
 
 fig = px.sunburst(plot_data, path=['checkin_type', 'delay'],
                   color_discrete_sequence = ['#8D1586','#261A48'],
@@ -110,24 +120,9 @@ st.plotly_chart(fig, use_container_width=True)
 st.subheader("How does the delay of a driver impact the next driver?")
 
 #Selecting rental ids for rentals that have a following rental 
-previous_rentals = data.loc[~data['previous_ended_rental_id'].isna(),'previous_ended_rental_id'].values.tolist()
-#Selecting the rentals and their following rental
-previous_rental_data = data.loc[data['rental_id'].isin(previous_rentals)|data['previous_ended_rental_id'].isin(previous_rentals),:]
-
-#Creating a binary delay column for rentals and their following rental
-def next_rental_delayed(x):
-    try:
-        y = previous_rental_data.loc[previous_rental_data['previous_ended_rental_id']==x,'delay_at_checkout_in_minutes'].values[0]
-        if np.isnan(y) or y<=0:
-            return "On time"
-        else:
-            return "Delayed"
-    except:
-        return np.nan
-#make a delay column
-previous_rental_data['delay'] = previous_rental_data['delay_at_checkout_in_minutes'].map(lambda x: "On time" if (x<=0 or np.isnan(x)) else "Delayed")
-#make a next_rental_delayed column  
-previous_rental_data['delay_next_rental'] = previous_rental_data['rental_id'].map(lambda x:next_rental_delayed(x))
+previous_rentals = previous_rental_ids(data)
+#Selecting the rentals and their following rental, with a delay column and a next_rental_delayed column
+previous_rental_data = next_rental_delays(data)
 
 plot_data = previous_rental_data.loc[previous_rental_data['rental_id'].isin(previous_rentals),:]
 
@@ -192,27 +187,7 @@ connect_opt = st.checkbox('Connect', key="key_4")
 
 plot_data=data_complete.loc[data['state']=="ended",:]
 
-mobile_share = 0
-connect_share = 0
-
-mobile_affected = 0
-connect_affected = 0
-
-total_mobile = plot_data.loc[(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-total_connect = plot_data.loc[(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-
-
-if mobile_opt and connect_opt:
-    mobile_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold)&(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-    connect_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold)&(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-elif mobile_opt and not connect_opt:
-    mobile_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold)&(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-elif not mobile_opt and connect_opt:
-    connect_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold)&(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-
-mobile_share = mobile_affected/total_mobile
-connect_share = connect_affected/total_connect
-total_share = (mobile_affected+connect_affected)/(total_mobile+total_connect)
+mobile_share, connect_share, total_share = threshold_shares(load_threshold_curve("ended", workbook_modified()), threshold, mobile_opt, connect_opt)
 
 fig = px.histogram(plot_data, 
                    x="time_delta_with_previous_rental_in_minutes",
@@ -256,27 +231,7 @@ connect_opt = st.checkbox('Connect', key="key_6")
 
 plot_data=data_complete.loc[data['state']=="canceled",:]
 
-mobile_share = 0
-connect_share = 0
-
-mobile_affected = 0
-connect_affected = 0
-
-total_mobile = plot_data.loc[(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-total_connect = plot_data.loc[(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-
-
-if mobile_opt and connect_opt:
-    mobile_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold_2)&(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-    connect_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold_2)&(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-elif mobile_opt and not connect_opt:
-    mobile_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold_2)&(plot_data["checkin_type"]=="mobile"),:]["rental_id"].count()
-elif not mobile_opt and connect_opt:
-    connect_affected = plot_data.loc[(plot_data["time_delta_with_previous_rental_in_minutes"]<=threshold_2)&(plot_data["checkin_type"]=="connect"),:]["rental_id"].count()
-
-mobile_share = mobile_affected/total_mobile
-connect_share = connect_affected/total_connect
-total_share = (mobile_affected+connect_affected)/(total_mobile+total_connect)
+mobile_share, connect_share, total_share = threshold_shares(load_threshold_curve("canceled", workbook_modified()), threshold_2, mobile_opt, connect_opt)
 
 fig = px.histogram(plot_data, 
                    x="time_delta_with_previous_rental_in_minutes",
@@ -0,0 +1,151 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset import LOCAL_XLSX, load_dataset
+
+
+def delay_labels(delays):
+    """Label checkout delays "Delayed" when positive, "On time" when negative, zero or missing."""
+    # missing delays compare as NA with nullable integers, as False with floats
+    delayed = (delays > 0).fillna(False).to_numpy(bool)
+    return pd.Series(np.where(delayed, "Delayed", "On time"), index=delays.index)
+
+
+def previous_rental_ids(data):
+    """Ids of the rentals followed by another rental, as listed in `previous_ended_rental_id`."""
+    return data.loc[~data['previous_ended_rental_id'].isna(), 'previous_ended_rental_id'].values.tolist()
+
+
+def next_rental_delays(data):
+    """Return the rentals followed by another rental and these following rentals, with their delay labels.
+
+    `delay` labels the delay of each rental and `delay_next_rental` the delay
+    of the rental that follows it, NaN when there is none. When several
+    rentals share a previous rental, the first one in `data` is taken as the
+    next rental. The next rentals are found with one lookup on their
+    `previous_ended_rental_id` instead of one scan of the data per rental.
+    """
+    previous_rentals = data['previous_ended_rental_id'].dropna()
+    previous_rental_data = data.loc[data['rental_id'].isin(previous_rentals) | data['previous_ended_rental_id'].isin(previous_rentals), :].copy()
+    previous_rental_data['delay'] = delay_labels(previous_rental_data['delay_at_checkout_in_minutes'])
+
+    # label of the first rental following each previous rental, indexed by that previous rental's id
+    next_rentals = previous_rental_data.loc[previous_rental_data['previous_ended_rental_id'].notna(), :]
+    next_rentals = next_rentals.drop_duplicates('previous_ended_rental_id', keep='first')
+    next_delay = pd.Series(next_rentals['delay'].values,
+                           index=next_rentals['previous_ended_rental_id'].astype(previous_rental_data['rental_id'].dtype))
+    previous_rental_data['delay_next_rental'] = previous_rental_data['rental_id'].map(next_delay)
+    return previous_rental_data
+
+
+def threshold_curve(rentals, max_threshold=740):
+    """Return, for every threshold from 0 to `max_threshold` minutes, the rentals within the threshold.
+
+    `rentals` are rentals with a previous rental, e.g. the ended or canceled
+    ones. For each checkin type, `<type>_affected` counts the rentals with
+    `time_delta_with_previous_rental_in_minutes` at most the threshold and
+    `<type>_share` is their share of the rentals of that type; `total_share`
+    is the share of all the rentals when the threshold applies to both
+    types. The counts come from binary searches of the thresholds in the
+    sorted time deltas, so the whole curve costs one sort per type.
+    """
+    thresholds = np.arange(max_threshold + 1)
+    curve = pd.DataFrame(index=pd.Index(thresholds, name="threshold"))
+    for checkin_type in ("mobile", "connect"):
+        deltas = rentals.loc[rentals["checkin_type"] == checkin_type, "time_delta_with_previous_rental_in_minutes"]
+        curve[f"{checkin_type}_rentals"] = len(deltas)
+        # rentals without time delta are counted in the total but never affected
+        curve[f"{checkin_type}_affected"] = np.searchsorted(np.sort(deltas.dropna().to_numpy()), thresholds, side="right")
+        curve[f"{checkin_type}_share"] = curve[f"{checkin_type}_affected"] / curve[f"{checkin_type}_rentals"]
+    curve["total_share"] = (curve["mobile_affected"] + curve["connect_affected"]) / (curve["mobile_rentals"] + curve["connect_rentals"])
+    return curve
+
+
+def threshold_shares(curve, threshold, mobile=True, connect=True):
+    """Look up the mobile, connect and total shares of the rentals affected by `threshold`.
+
+    The threshold only applies to the checkin types selected by `mobile`
+    and `connect`, the shares of the others are 0.
+    """
+    row = curve.loc[threshold]
+    mobile_affected = row["mobile_affected"] if mobile else 0
+    connect_affected = row["connect_affected"] if connect else 0
+    mobile_share = mobile_affected / row["mobile_rentals"]
+    connect_share = connect_affected / row["connect_rentals"]
+    total_share = (mobile_affected + connect_affected) / (row["mobile_rentals"] + row["connect_rentals"])
+    return mobile_share, connect_share, total_share
+
+
+def reference_threshold_shares(rentals, threshold, mobile=True, connect=True):
+    """The original filtering of the dashboard for one threshold, kept to check `threshold_curve` against it."""
+    mobile_affected = 0
+    connect_affected = 0
+    total_mobile = rentals.loc[(rentals["checkin_type"]=="mobile"),:]["rental_id"].count()
+    total_connect = rentals.loc[(rentals["checkin_type"]=="connect"),:]["rental_id"].count()
+    if mobile:
+        mobile_affected = rentals.loc[(rentals["time_delta_with_previous_rental_in_minutes"]<=threshold)&(rentals["checkin_type"]=="mobile"),:]["rental_id"].count()
+    if connect:
+        connect_affected = rentals.loc[(rentals["time_delta_with_previous_rental_in_minutes"]<=threshold)&(rentals["checkin_type"]=="connect"),:]["rental_id"].count()
+    return mobile_affected/total_mobile, connect_affected/total_connect, (mobile_affected+connect_affected)/(total_mobile+total_connect)
+
+
+def reference_next_rental_delays(data):
+    """The original per-rental scan of the dashboard, kept to check `next_rental_delays` against it."""
+    previous_rentals = previous_rental_ids(data)
+    previous_rental_data = data.loc[data['rental_id'].isin(previous_rentals)|data['previous_ended_rental_id'].isin(previous_rentals),:].copy()
+
+    def next_rental_delayed(x):
+        try:
+            y = previous_rental_data.loc[previous_rental_data['previous_ended_rental_id']==x,'delay_at_checkout_in_minutes'].values[0]
+            if np.isnan(y) or y<=0:
+                return "On time"
+            else:
+                return "Delayed"
+        except:
+            return np.nan
+    previous_rental_data['delay'] = previous_rental_data['delay_at_checkout_in_minutes'].map(lambda x: "On time" if (x<=0 or np.isnan(x)) else "Delayed")
+    previous_rental_data['delay_next_rental'] = previous_rental_data['rental_id'].map(lambda x:next_rental_delayed(x))
+    return previous_rental_data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the dashboard analysis against the original per-rental computations.")
+    parser.add_argument("--data", default=LOCAL_XLSX)
+    parser.add_argument("--export", metavar="CSV", help="write the threshold curves of the ended and canceled rentals")
+    args = parser.parse_args()
+
+    # the analysis runs on the cached data with compact dtypes, the original computations on the workbook
+    cached = load_dataset(args.data)
+    data = pd.read_excel(args.data)
+    start = time.perf_counter()
+    fast = next_rental_delays(cached)
+    fast_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    reference = reference_next_rental_delays(data)
+    reference_seconds = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(fast, reference, check_dtype=False, check_categorical=False)
+    print(f"{len(fast)} rentals, same labels: {fast_seconds:.3f}s against {reference_seconds:.1f}s")
+
+    data_complete = data.loc[data["time_delta_with_previous_rental_in_minutes"].notna(),:]
+    cached_complete = cached.loc[cached["time_delta_with_previous_rental_in_minutes"].notna(),:]
+    curves = {}
+    for state in ("ended", "canceled"):
+        rentals = data_complete.loc[data_complete["state"] == state, :]
+        start = time.perf_counter()
+        curves[state] = threshold_curve(cached_complete.loc[cached_complete["state"] == state, :])
+        curve_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for threshold in curves[state].index:
+            for options in ((True, True), (True, False), (False, True), (False, False)):
+                expected = reference_threshold_shares(rentals, threshold, *options)
+                np.testing.assert_allclose(threshold_shares(curves[state], threshold, *options), expected, rtol=1e-12)
+        reference_seconds = (time.perf_counter() - start) / (4 * len(curves[state]))
+        print(f"{state}: same shares for every threshold, curve in {curve_seconds*1000:.1f}ms "
+              f"against {reference_seconds*1000:.1f}ms per threshold")
+
+    if args.export:
+        pd.concat(curves, names=["state"]).to_csv(args.export)
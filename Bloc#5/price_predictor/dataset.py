@@ -0,0 +1,104 @@
+import argparse
+import hashlib
+import os
+import shutil
+import time
+import urllib.request
+
+import pandas as pd
+
+DATASET_URL = "https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_pricing_project.csv"
+# copy of the dataset bundled with the project, and its sha256
+LOCAL_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "get_around_pricing_project.csv")
+SHA256 = "cbc7e7e3e05837c21690ef49a1741c962ab79b1909df3c9bae883ead84f58c8f"
+# Parquet copies of the dataset, named after the checksum of the CSV they come from
+CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join(os.path.dirname(LOCAL_CSV), ".cache"))
+
+# compact dtypes of the columns, the text columns become categories
+# (the model inputs stay int64, the type of the model signature the API checks its inputs against)
+DTYPES = {
+    "model_key": "category",
+    "mileage": "int64",
+    "engine_power": "int64",
+    "fuel": "category",
+    "paint_color": "category",
+    "car_type": "category",
+    "private_parking_available": "bool",
+    "has_gps": "bool",
+    "has_air_conditioning": "bool",
+    "automatic_car": "bool",
+    "has_getaround_connect": "bool",
+    "has_speed_regulator": "bool",
+    "winter_tires": "bool",
+    "rental_price_per_day": "int32",
+}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fetch_csv(path=LOCAL_CSV, url=DATASET_URL, sha256=SHA256):
+    """Return the path of a verified copy of the CSV, downloading it from `url` if `path` is missing.
+
+    Raises ValueError when the checksum of the file does not match `sha256`.
+    """
+    if not os.path.exists(path):
+        print(f"downloading {url}...")
+        tmp_path = path + ".part"
+        with urllib.request.urlopen(url) as response, open(tmp_path, "wb") as f:
+            shutil.copyfileobj(response, f)
+        os.replace(tmp_path, path)
+    checksum = file_sha256(path)
+    if checksum != sha256:
+        raise ValueError(f"Checksum of {path} is {checksum}, expected {sha256}")
+    return path
+
+
+def cache_path(sha256=SHA256, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"get_around_pricing_project-{sha256[:16]}.parquet")
+
+
+def load_dataset(sha256=SHA256, cache_dir=CACHE_DIR):
+    """Return the GetAround pricing dataset as a DataFrame with compact dtypes.
+
+    Every call verifies the CSV (see `fetch_csv`), so a CSV replaced since
+    its cache was built raises ValueError instead of being read from the
+    stale cache. The first call converts the CSV to a Parquet file in
+    `cache_dir`, named after its checksum; later calls read that file.
+    """
+    csv_path = fetch_csv(sha256=sha256)
+    path = cache_path(sha256, cache_dir)
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    df = pd.read_csv(csv_path, index_col=[0], dtype=DTYPES)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".part"
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the pricing dataset and build its Parquet cache.")
+    parser.add_argument("--compare", action="store_true", help="compare the load time and memory with the CSV")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = load_dataset()
+    print(f"{len(df)} rows loaded in {time.perf_counter() - start:.3f}s from {cache_path()}")
+
+    if args.compare:
+        start = time.perf_counter()
+        df = load_dataset()
+        cached = time.perf_counter() - start, df.memory_usage(deep=True).sum()
+        start = time.perf_counter()
+        df = pd.read_csv(LOCAL_CSV, index_col=[0])
+        csv = time.perf_counter() - start, df.memory_usage(deep=True).sum()
+        print(f"parquet cache: {cached[0]*1000:.1f} ms, {cached[1]/1e6:.2f} MB")
+        print(f"CSV:           {csv[0]*1000:.1f} ms, {csv[1]/1e6:.2f} MB")
@@ -0,0 +1,107 @@
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.model_selection import KFold, train_test_split
+
+from xgboost import XGBRegressor
+
+# Random search space of the XGBoost parameters, the number of trees is set by early stopping
+SPACE = {
+    "max_depth": lambda rng: int(rng.integers(3, 9)),
+    "learning_rate": lambda rng: float(np.exp(rng.uniform(np.log(0.01), np.log(0.3)))),
+    "subsample": lambda rng: float(rng.uniform(0.6, 1.0)),
+    "colsample_bytree": lambda rng: float(rng.uniform(0.5, 1.0)),
+    "min_child_weight": lambda rng: float(np.exp(rng.uniform(0, np.log(10)))),
+    "reg_lambda": lambda rng: float(np.exp(rng.uniform(np.log(0.1), np.log(10)))),
+}
+
+
+def sample_params(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{name: draw(rng) for name, draw in SPACE.items()} for _ in range(n)]
+
+
+def rmse(predictions, Y):
+    return float(np.sqrt(np.mean((predictions - Y) ** 2)))
+
+
+def fit_fold(X, Y, train_idx, valid_idx, params, max_rounds, early_stopping_rounds=20, seed=0):
+    """Fit XGBoost on one fold and return its validation RMSE, best round and fit time.
+
+    A tenth of the training rows of the fold is held out for early stopping,
+    so that the validation rows only measure the score.
+    """
+    start = time.perf_counter()
+    fit_idx, stop_idx = train_test_split(train_idx, test_size=0.1, random_state=seed)
+    regressor = XGBRegressor(n_estimators=max_rounds, early_stopping_rounds=early_stopping_rounds, n_jobs=1,
+                             random_state=seed, **params)
+    regressor.fit(X[fit_idx], Y[fit_idx], eval_set=[(X[stop_idx], Y[stop_idx])], verbose=False)
+    predictions = regressor.predict(X[valid_idx], iteration_range=(0, regressor.best_iteration + 1))
+    return rmse(predictions, Y[valid_idx]), regressor.best_iteration + 1, time.perf_counter() - start
+
+
+def evaluate(X, Y, candidates, max_rounds, folds=5, n_jobs=-1, seed=0):
+    """Cross-validate every parameter set of `candidates` with at most `max_rounds` trees.
+
+    `X` is the encoded model input (the preprocessing of the pipeline has no
+    parameter to tune, it is fitted once before the search) and `Y` a numpy
+    array of prices. All the folds of all the candidates are fitted in parallel on `n_jobs`
+    processes. Returns one trial dict per candidate with its mean and
+    standard deviation of RMSE, number of trees, summed fit time and wall
+    time (of its slowest fold).
+    """
+    splits = list(KFold(folds, shuffle=True, random_state=seed).split(Y))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(fit_fold)(X, Y, train_idx, valid_idx, params, max_rounds, seed=seed)
+        for params in candidates for train_idx, valid_idx in splits)
+    trials = []
+    for i, params in enumerate(candidates):
+        rmse, rounds, seconds = zip(*results[i * folds:(i + 1) * folds])
+        trials.append({
+            "params": params,
+            "max_rounds": max_rounds,
+            "rmse": float(np.mean(rmse)),
+            "rmse_std": float(np.std(rmse)),
+            "n_estimators": int(np.mean(rounds)),
+            "fit_seconds": float(np.sum(seconds)),
+            "wall_seconds": float(np.max(seconds)),
+        })
+    return trials
+
+
+def random_search(X, Y, n_trials=20, max_rounds=1000, folds=5, n_jobs=-1, seed=0):
+    """Evaluate `n_trials` random parameter sets with the full budget of `max_rounds` trees."""
+    return evaluate(X, Y, sample_params(n_trials, seed), max_rounds, folds, n_jobs, seed)
+
+
+def halving_search(X, Y, n_trials=27, max_rounds=1000, folds=5, n_jobs=-1, seed=0, factor=3):
+    """Successive halving: evaluate all the parameter sets with few trees, keep the best `1/factor`, and so on.
+
+    The budget of every rung is `factor` times the budget of the previous
+    one, up to `max_rounds` trees for the last survivors. Returns the trials
+    of every rung.
+    """
+    candidates = sample_params(n_trials, seed)
+    rungs = 0
+    while factor ** (rungs + 1) <= n_trials:
+        rungs += 1
+    trials = []
+    for rung in range(rungs + 1):
+        budget = max(int(max_rounds / factor ** (rungs - rung)), 1)
+        rung_trials = evaluate(X, Y, candidates, budget, folds, n_jobs, seed)
+        for trial in rung_trials:
+            trial["rung"] = rung
+        trials += rung_trials
+        ranked = sorted(rung_trials, key=lambda trial: trial["rmse"])
+        candidates = [trial["params"] for trial in ranked[:max(len(ranked) // factor, 1)]]
+    return trials
+
+
+SEARCHES = {"random": random_search, "halving": halving_search}
+
+
+def best_trial(trials):
+    """Return the trial of lowest RMSE among those trained with the full budget."""
+    budget = max(trial["max_rounds"] for trial in trials)
+    return min((trial for trial in trials if trial["max_rounds"] == budget), key=lambda trial: trial["rmse"])
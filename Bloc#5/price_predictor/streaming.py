@@ -0,0 +1,169 @@
+import os
+
+import numpy as np
+import pandas as pd
+import xgboost
+from scipy import sparse
+
+from dataset import DTYPES
+
+TARGET = "rental_price_per_day"
+
+
+def read_chunks(path, chunk_size=100000):
+    """Yield the rows of a CSV or Parquet dataset `chunk_size` at a time."""
+    if path.endswith((".parquet", ".pq")):
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, index_col=[0], dtype=DTYPES, chunksize=chunk_size)
+
+
+class RunningStats:
+    """Count, mean and sum of squared deviations of columns, merged chunk by chunk (Chan et al.)."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.count = 0
+        self.mean = np.zeros(len(columns))
+        self.m2 = np.zeros(len(columns))
+
+    def update(self, frame):
+        values = frame[self.columns].to_numpy(np.float64)
+        if not len(values):
+            return
+        count, mean = len(values), values.mean(axis=0)
+        m2 = ((values - mean) ** 2).sum(axis=0)
+        delta = mean - self.mean
+        total = self.count + count
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def std(self, ddof=0):
+        return np.sqrt(self.m2 / (self.count - ddof))
+
+
+def outlier_bounds(chunks, columns):
+    """One pass over the data: the 3-sigma bounds of `columns` used by `train.remove_outliers`."""
+    stats = RunningStats(columns)
+    for chunk in chunks:
+        stats.update(chunk)
+    # pandas std, i.e. with one degree of freedom
+    std = stats.std(ddof=1)
+    return stats.mean - 3 * std, stats.mean + 3 * std
+
+
+def keep_rows(chunk, columns, bounds):
+    """Rows of `chunk` strictly within the outlier `bounds`, as in `train.remove_outliers`."""
+    values = chunk[columns].to_numpy(np.float64)
+    return chunk[np.all((bounds[0] < values) & (values < bounds[1]), axis=1)]
+
+
+def fit_layout(chunks, numeric_features, categorical_features, bounds):
+    """One pass over the rows kept: the `encoder.json` layout the pipeline of train.py would learn.
+
+    The scaler statistics are the mean and population standard deviation of
+    the numeric features, the categories are sorted and the first one is
+    dropped, as by the StandardScaler and OneHotEncoder(drop='first'). The
+    encoded chunks are sparse matrices, whose zeros XGBoost reads as missing.
+    """
+    stats = RunningStats(numeric_features)
+    categories = [set() for _ in categorical_features]
+    for chunk in chunks:
+        chunk = keep_rows(chunk, numeric_features, bounds)
+        stats.update(chunk)
+        for values, feature in zip(categories, categorical_features):
+            values.update(chunk[feature].unique().tolist())
+    scale = stats.std()
+    return {
+        "numeric_features": numeric_features,
+        "mean": stats.mean.tolist(),
+        # constant features are not scaled, like in StandardScaler
+        "scale": np.where(scale == 0, 1.0, scale).tolist(),
+        "categorical_features": categorical_features,
+        "categories": [sorted(values) for values in categories],
+        "drop": [0 for _ in categorical_features],
+        "sparse": True,
+    }
+
+
+def encode_chunk(layout, chunk):
+    """Encode a chunk with a frozen layout into a CSR matrix of the pipeline's columns."""
+    n_numeric = len(layout["numeric_features"])
+    numeric = (chunk[layout["numeric_features"]].to_numpy(np.float64) - layout["mean"]) / layout["scale"]
+    # coordinates of the values of every block of columns
+    rows = [np.repeat(np.arange(len(chunk)), n_numeric)]
+    columns = [np.tile(np.arange(n_numeric), len(chunk))]
+    values = [numeric.ravel()]
+    offset = n_numeric
+    for feature, categories, drop in zip(layout["categorical_features"], layout["categories"], layout["drop"]):
+        kept = [category for i, category in enumerate(categories) if i != drop]
+        positions = pd.Series(range(offset, offset + len(kept)), index=kept)
+        found = chunk[feature].map(positions).to_numpy(np.float64)
+        # the dropped category and the categories unseen by the layout have no column
+        hit = ~np.isnan(found)
+        rows.append(np.flatnonzero(hit))
+        columns.append(found[hit].astype(np.intp))
+        values.append(np.ones(hit.sum()))
+        offset += len(kept)
+    rows, columns, values = np.concatenate(rows), np.concatenate(columns), np.concatenate(values)
+    matrix = sparse.csr_matrix((values, (rows, columns)), shape=(len(chunk), offset), dtype=np.float32)
+    # zeros are not stored, as in the sparse output of the ColumnTransformer
+    matrix.eliminate_zeros()
+    return matrix
+
+
+class ChunkIter(xgboost.DataIter):
+    """Feeds XGBoost the encoded chunks of the kept rows, one at a time, as often as it asks."""
+
+    def __init__(self, path, chunk_size, layout, bounds, cache_prefix=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.layout = layout
+        self.bounds = bounds
+        self.chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        self.chunks = read_chunks(self.path, self.chunk_size)
+
+    def next(self, input_data):
+        if self.chunks is None:
+            self.reset()
+        for chunk in self.chunks:
+            chunk = keep_rows(chunk, self.layout["numeric_features"], self.bounds)
+            if len(chunk):
+                input_data(data=encode_chunk(self.layout, chunk), label=chunk[TARGET].to_numpy(np.float32))
+                return True
+        return False
+
+
+def train_streaming(path, numeric_features, categorical_features, params, num_boost_round=100,
+                    chunk_size=100000, external_memory=None):
+    """Train XGBoost on a dataset too large for memory, reading it `chunk_size` rows at a time.
+
+    Two passes compute the outlier bounds, then the encoder layout of the
+    rows kept; XGBoost then reads the encoded chunks through a data
+    iterator. By default they are binned into a QuantileDMatrix, which only
+    keeps one byte per stored value in memory; with `external_memory`, a
+    directory, the binned pages are cached there on disk instead. Returns
+    the booster and the layout.
+    """
+    bounds = outlier_bounds(read_chunks(path, chunk_size), numeric_features)
+    layout = fit_layout(read_chunks(path, chunk_size), numeric_features, categorical_features, bounds)
+
+    if external_memory:
+        os.makedirs(external_memory, exist_ok=True)
+        iterator = ChunkIter(path, chunk_size, layout, bounds, cache_prefix=os.path.join(external_memory, "cache"))
+        if hasattr(xgboost, "ExtMemQuantileDMatrix"):
+            data = xgboost.ExtMemQuantileDMatrix(iterator, max_bin=256)
+        else:
+            data = xgboost.DMatrix(iterator)
+    else:
+        data = xgboost.QuantileDMatrix(ChunkIter(path, chunk_size, layout, bounds), max_bin=256)
+
+    booster = xgboost.train({"tree_method": "hist", **params}, data, num_boost_round=num_boost_round)
+    return booster, layout
@@ -1,54 +1,44 @@
 import os
+import json
+import time
 import argparse
-import pandas as pd
+import tempfile
+import numpy as np
 import mlflow
+import xgboost
 from mlflow.models.signature import infer_signature
 from sklearn.preprocessing import  StandardScaler, OneHotEncoder
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
+from sklearn.model_selection import train_test_split
 from xgboost import XGBRegressor
 
+from dataset import fetch_csv, load_dataset
 
-if __name__ == "__main__":
-
-    # Set your variables for your environment
-    EXPERIMENT_NAME="test-experiment"
 
-    # Instanciate your experiment
-    client = mlflow.tracking.MlflowClient()
-    mlflow.set_tracking_uri(os.environ["MLFLOW_TRACKING_URI"])
+# Version of the layout of the lite model directory, checked by the API
+LITE_FORMAT = 1
 
-    # Set experiment's info 
-    mlflow.set_experiment(EXPERIMENT_NAME)
-
-    # Get our experiment info
-    experiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
-    run = client.create_run(experiment.experiment_id) # Creates a new run for a given experiment
-    
-    print("training model...")
-    
-    mlflow.xgboost.autolog()
+# Model input columns
+numeric_features = ["mileage", "engine_power"]
+categorical_features = ["model_key", "fuel", "paint_color", "car_type", "private_parking_available", "has_gps", "has_air_conditioning", "automatic_car", "has_getaround_connect", "has_speed_regulator", "winter_tires"]
 
-    # Import dataset
-    df = pd.read_csv("https://full-stack-assets.s3.eu-west-3.amazonaws.com/Deployment/get_around_pricing_project.csv", index_col=[0])
 
+def remove_outliers(df):
     #remove outliers in mileage and engine_power columns
     mileage_filter = ((df['mileage'].mean() - 3*df['mileage'].std()) < df['mileage']) & (df['mileage'] < (df['mileage'].mean() + 3*df['mileage'].std())) 
     engine_filter = ((df['engine_power'].mean() - 3*df['engine_power'].std()) < df['engine_power']) & (df['engine_power'] < (df['engine_power'].mean() + 3*df['engine_power'].std())) 
     filters = mileage_filter & engine_filter
-    df_clean = df.loc[filters,:]
+    return df.loc[filters,:]
 
-    # divide target and features
-    Y = df_clean.loc[:,'rental_price_per_day']
-    X = df_clean.iloc[:,0:13]
 
+def build_model(max_depth=4, **params):
+    """Return the preprocessing and XGBoost pipeline, `params` are passed to XGBRegressor."""
     # Define feature processing
-    numeric_features = ["mileage", "engine_power"]
     numeric_transformer = Pipeline(steps=[
         ('scaler', StandardScaler())
         ])
 
-    categorical_features = ["model_key", "fuel", "paint_color", "car_type", "private_parking_available", "has_gps", "has_air_conditioning", "automatic_car", "has_getaround_connect", "has_speed_regulator", "winter_tires"]
     categorical_transformer = Pipeline(
         steps=[
         ('encoder', OneHotEncoder(drop='first'))
@@ -61,26 +51,184 @@ if __name__ == "__main__":
             ('cat', categorical_transformer, categorical_features)
         ])
 
-    model = Pipeline(steps=[
+    return Pipeline(steps=[
     ("Preprocessing", preprocessor),
-    ("Model",XGBRegressor(max_depth=4))
+    ("Model",XGBRegressor(max_depth=max_depth, **params))
     ]) 
 
+
+def encoder_layout(model, numeric_features, categorical_features):
+    """Export the fitted preprocessing of the pipeline as plain JSON-able values.
+
+    It holds the scaler means and standard deviations, the one-hot categories
+    and dropped category of each feature, and whether the ColumnTransformer
+    outputs a sparse matrix, in which case XGBoost treats the zeros as
+    missing values. The API uses it to encode single predictions without
+    pandas nor sklearn (see API/fast_encoder.py).
+    """
+    preprocessor = model.named_steps["Preprocessing"]
+    scaler = preprocessor.named_transformers_["num"].named_steps["scaler"]
+    encoder = preprocessor.named_transformers_["cat"].named_steps["encoder"]
+    drop_idx = encoder.drop_idx_ if encoder.drop_idx_ is not None else [None] * len(encoder.categories_)
+    return {
+        "numeric_features": numeric_features,
+        "mean": scaler.mean_.tolist(),
+        "scale": scaler.scale_.tolist(),
+        "categorical_features": categorical_features,
+        "categories": [categories.tolist() for categories in encoder.categories_],
+        "drop": [None if idx is None else int(idx) for idx in drop_idx],
+        "sparse": bool(preprocessor.sparse_output_),
+    }
+
+
+def save_lite_model(booster, layout, path, **meta):
+    """Write the lite model of a trained XGBoost booster to the directory `path`.
+
+    It only holds the native XGBoost booster (`model.ubj`), the
+    `encoder.json` layout and a `meta.json` with the format version and the
+    given `meta` (run id, registered version), so that the API can serve it
+    with numpy and xgboost alone, without mlflow nor sklearn.
+    """
+    os.makedirs(path, exist_ok=True)
+    booster.save_model(os.path.join(path, "model.ubj"))
+    with open(os.path.join(path, "encoder.json"), "w") as f:
+        json.dump(layout, f)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"format": LITE_FORMAT, "xgboost": xgboost.__version__, **meta}, f)
+
+
+def log_search(trials, search_seconds):
+    """Log every trial of a search as a nested run of the active run."""
+    for i, trial in enumerate(trials):
+        with mlflow.start_run(run_name=f"trial-{i}", nested=True):
+            mlflow.log_params({**trial["params"], "max_rounds": trial["max_rounds"], "rung": trial.get("rung", 0)})
+            mlflow.log_metrics({name: trial[name] for name in ("rmse", "rmse_std", "n_estimators", "fit_seconds", "wall_seconds")})
+    mlflow.log_metrics({"search_seconds": search_seconds, "trials": len(trials)})
+
+
+def train_stream(args, run_id):
+    """Train out of core on `args.data` and log the lite model, the only model this mode produces.
+
+    The booster reads a sparse encoding of the rows, which the sklearn
+    pipeline logged by the other modes cannot take, so nothing is registered
+    as xgbmodel: the API serves the lite model with LITE_MODEL_PATH.
+    """
+    from streaming import train_streaming
+
+    with mlflow.start_run(run_id=run_id):
+        start = time.perf_counter()
+        booster, layout = train_streaming(args.data or fetch_csv(), numeric_features, categorical_features,
+                                          {"max_depth": 4}, chunk_size=args.chunk_size,
+                                          external_memory=args.external_memory)
+        mlflow.log_params({"mode": "stream", "max_depth": 4, "chunk_size": args.chunk_size,
+                           "external_memory": bool(args.external_memory)})
+        mlflow.log_metric("train_seconds", time.perf_counter() - start)
+        mlflow.log_dict(layout, "encoder.json")
+        save_lite_model(booster, layout, args.lite_out, run_id=run_id, model_name="xgbmodel", model_version=None)
+        mlflow.log_artifacts(args.lite_out, "lite_model")
+        print(f"lite model written to {args.lite_out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the pricing model and register it as xgbmodel.")
+    parser.add_argument("--search", choices=["random", "halving"], default=None,
+                        help="search the XGBoost parameters instead of training max_depth=4")
+    parser.add_argument("--trials", type=int, default=20, help="parameter sets tried by the search")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds of every trial")
+    parser.add_argument("--max-rounds", type=int, default=1000, help="most trees of a trial, early stopping picks fewer")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="processes fitting the folds, -1 for all cores")
+    parser.add_argument("--test-size", type=float, default=0.2, help="share of the data held out to score the best model")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true",
+                        help="train out of core, reading the dataset in chunks, and only output the lite model")
+    parser.add_argument("--data", default=None, help="CSV or Parquet dataset of --stream, the bundled CSV by default")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="rows read at once by --stream")
+    parser.add_argument("--external-memory", default=None,
+                        help="directory where --stream caches the binned data on disk instead of in memory")
+    parser.add_argument("--lite-out", default="lite_model", help="directory of the lite model written by --stream")
+    args = parser.parse_args()
+
+    # Set your variables for your environment
+    EXPERIMENT_NAME="test-experiment"
+
+    # Instanciate your experiment, runs are logged to a local store (mlflow.db and mlruns/) unless MLFLOW_TRACKING_URI is set
+    mlflow.set_tracking_uri(os.environ.get("MLFLOW_TRACKING_URI") or "sqlite:///" + os.path.abspath("mlflow.db"))
+    client = mlflow.tracking.MlflowClient()
+
+    # Set experiment's info 
+    mlflow.set_experiment(EXPERIMENT_NAME)
+
+    # Get our experiment info
+    experiment = mlflow.get_experiment_by_name(EXPERIMENT_NAME)
+    run = client.create_run(experiment.experiment_id) # Creates a new run for a given experiment
+    
+    print("training model...")
+
+    if args.stream:
+        train_stream(args, run.info.run_id)
+        print("...Done!")
+        raise SystemExit
+
+    # Import dataset, from the local Parquet cache after the first run (see dataset.py)
+    df = load_dataset()
+
+    df_clean = remove_outliers(df)
+
+    # divide target and features
+    Y = df_clean.loc[:,'rental_price_per_day']
+    X = df_clean.iloc[:,0:13]
+
+    model = build_model()
+
     # Log experiment to MLFlow
     with mlflow.start_run(run_id = run.info.run_id) as run:
         #debug
         print(mlflow.get_artifact_uri())
         print(mlflow.get_tracking_uri())
 
+        if args.search:
+            from search import SEARCHES, best_trial, rmse
+
+            # the preprocessing only learns the scaling and the categories, it is fitted once on all the rows
+            # so that every fold knows the rare categories
+            X_encoded = model.named_steps["Preprocessing"].fit_transform(X)
+            prices = Y.to_numpy()
+            train_idx, test_idx = train_test_split(np.arange(len(prices)), test_size=args.test_size, random_state=args.seed)
+
+            # the trials stop early on held-out rows of their folds, the best one is then scored on the test rows
+            start = time.perf_counter()
+            trials = SEARCHES[args.search](X_encoded[train_idx], prices[train_idx], args.trials, args.max_rounds,
+                                           args.folds, args.n_jobs, args.seed)
+            log_search(trials, time.perf_counter() - start)
+            best = best_trial(trials)
+            print(f"best of {len(trials)} trials in {time.perf_counter() - start:.1f}s: rmse {best['rmse']:.2f}, {best['params']}")
+            regressor = XGBRegressor(n_estimators=best["n_estimators"], random_state=args.seed, **best["params"])
+            regressor.fit(X_encoded[train_idx], prices[train_idx])
+            mlflow.log_params({"search": args.search, **best["params"], "n_estimators": best["n_estimators"]})
+            mlflow.log_metric("test_rmse", rmse(regressor.predict(X_encoded[test_idx]), prices[test_idx]))
+
+            # the registered model is trained on all the rows with the best parameters
+            model = build_model(n_estimators=best["n_estimators"], random_state=args.seed, **best["params"])
+
+        mlflow.xgboost.autolog()
         model.fit(X, Y)
         predictions = model.predict(X)
         print(predictions)
 
-        mlflow.sklearn.log_model(
+        model_info = mlflow.sklearn.log_model(
             sk_model=model,
             artifact_path="getaround_estimator",
             registered_model_name="xgbmodel",
-            signature=infer_signature(X, predictions)
+            signature=infer_signature(X, predictions),
+            serialization_format="cloudpickle"
         )
+        layout = encoder_layout(model, numeric_features, categorical_features)
+        mlflow.log_dict(layout, "encoder.json")
+
+        # Lite model for the API, served without mlflow nor sklearn (see API/README)
+        with tempfile.TemporaryDirectory() as lite_dir:
+            save_lite_model(model.named_steps["Model"].get_booster(), layout, lite_dir, run_id=run.info.run_id,
+                            model_name="xgbmodel", model_version=getattr(model_info, "registered_model_version", None))
+            mlflow.log_artifacts(lite_dir, "lite_model")
         
     print("...Done!")
\ No newline at end of file
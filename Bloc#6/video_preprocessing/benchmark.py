@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from extraction import extract_folder
+
+# extraction modes compared by the benchmark
+MODES = {
+    "baseline": {},
+    "scaled": {"detect_scale": 0.5},
+    "tracked": {"track": True},
+    "pipelined": {"pipeline": True},
+}
+
+
+def make_video(path, face, width=1280, height=720, fps=30, seconds=10, seed=0):
+    """Write a synthetic .mp4 with a face moving over a textured background.
+
+    `face` is a BGR face picture pasted on every frame: the detector needs a
+    real face to find, otherwise every video has too few faces and the crop
+    and write stages are never measured.
+    """
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    background = cv2.GaussianBlur(background, (0, 0), 5)
+    size = height // 3
+    face = cv2.resize(face, (size, size))
+
+    video = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(int(fps * seconds)):
+        frame = background.copy()
+        x = int((width - size) * (0.5 + 0.4 * np.sin(i / fps)))
+        y = (height - size) // 2
+        frame[y:y + size, x:x + size] = face
+        video.write(frame)
+    video.release()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(videoFolder, modes, workers=1):
+    results = {}
+    for name in modes:
+        stats_path = os.path.join(videoFolder, f"stats_{name}.json")
+        extract_folder(videoFolder, workers=workers, force=True, stats_path=stats_path, **MODES[name])
+        with open(stats_path) as f:
+            summary = json.load(f)
+        summary.pop("per_video")
+        results[name] = summary
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the video extraction on synthetic videos.")
+    parser.add_argument("--videos", type=int, default=4, help="number of synthetic videos")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30, help="frame rate of the synthetic videos")
+    parser.add_argument("--seconds", type=float, default=10, help="length of the synthetic videos")
+    parser.add_argument("--face", required=True, help="face picture pasted on the synthetic videos, e.g. a frame of a Celeb-DF video")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--out", default="benchmark_results.jsonl",
+                        help="results are appended to this JSON lines file to compare versions")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic videos and outputs")
+    args = parser.parse_args()
+
+    face = cv2.imread(args.face)
+    if face is None:
+        parser.error(f"Cannot read the face picture {args.face}")
+    videoFolder = tempfile.mkdtemp(prefix="extraction_benchmark_")
+    try:
+        for i in range(args.videos):
+            make_video(os.path.join(videoFolder, f"synthetic_{i}.mp4"), face, args.width, args.height,
+                       args.fps, args.seconds, seed=i)
+        results = run_benchmark(videoFolder, args.modes, workers=args.workers)
+    finally:
+        if args.keep:
+            print(f"Synthetic videos kept in {videoFolder}")
+        else:
+            shutil.rmtree(videoFolder)
+
+    record = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpus": os.cpu_count(),
+        "videos": vars(args),
+        "results": results,
+    }
+    with open(args.out, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+    print(f"{'mode':<10} {'frames/s':>10} {'videos/h':>10} " + " ".join(f"{name:>8}" for name in results[args.modes[0]]["stage_seconds"]))
+    for name, summary in results.items():
+        stages = " ".join(f"{value:>7.2f}s" for value in summary["stage_seconds"].values())
+        print(f"{name:<10} {summary['frames_per_second']:>10.1f} {summary['videos_per_hour']:>10.0f} {stages}")
+        if not summary["counts"].get("faces_found"):
+            print(f"{'':<10} no face found: the crop and write stages were not measured, try another --face picture")
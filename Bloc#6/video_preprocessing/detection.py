@@ -0,0 +1,121 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+import face_recognition
+
+from frames import sample_frames
+
+
+def scale_locations(locations, scale, shape):
+    """Scale `(top, right, bottom, left)` boxes found on a resized image back to `shape`."""
+    height, width = shape[:2]
+    scaled = []
+    for top, right, bottom, left in locations:
+        scaled.append((
+            max(int(round(top / scale)), 0),
+            min(int(round(right / scale)), width),
+            min(int(round(bottom / scale)), height),
+            max(int(round(left / scale)), 0),
+        ))
+    return scaled
+
+
+def detect_faces(image, scale=1.0, upsample=1):
+    """Face locations of an RGB image, detected on a copy resized by `scale`.
+
+    Detection uses the CPU HOG model of face_recognition. With `scale` < 1 the
+    detector scans fewer pixels and the boxes are scaled back to the original
+    image; `upsample` is the number of times the detector upsamples the image
+    to find small faces (face_recognition defaults to 1).
+    """
+    if scale == 1:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample)
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    locations = face_recognition.face_locations(small, number_of_times_to_upsample=upsample)
+    return scale_locations(locations, scale, image.shape)
+
+
+def detect_with_scores(image, scale=1.0, upsample=1):
+    """Like detect_faces, but returns `(location, score)` pairs sorted by decreasing score.
+
+    Scores are the HOG detector confidences, as returned by dlib's
+    `run(image, upsample, 0)` on the detector face_recognition uses.
+    """
+    small = image if scale == 1 else cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    rects, scores, _ = face_recognition.api.face_detector.run(small, upsample, 0)
+    locations = [(rect.top(), rect.right(), rect.bottom(), rect.left()) for rect in rects]
+    locations = scale_locations(locations, scale, image.shape)
+    return sorted(zip(locations, scores), key=lambda item: -item[1])
+
+
+def box_iou(a, b):
+    top = max(a[0], b[0])
+    right = min(a[1], b[1])
+    bottom = min(a[2], b[2])
+    left = max(a[3], b[3])
+    inter = max(bottom - top, 0) * max(right - left, 0)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare_detection(images, scale=0.5, upsample=1):
+    """Compare downscaled detection to full resolution detection, frame by frame.
+
+    The reference is `face_recognition.face_locations` on each full resolution
+    frame, as in the original extractors. Only the first face of each frame is
+    compared, since it is the one the extractors keep.
+    """
+    start = time.time()
+    reference = [face_recognition.face_locations(image) for image in images]
+    reference_time = time.time() - start
+
+    start = time.time()
+    fast = [detect_faces(image, scale=scale, upsample=upsample) for image in images]
+    fast_time = time.time() - start
+
+    ious = []
+    missed = 0
+    extra = 0
+    for ref, found in zip(reference, fast):
+        if ref and found:
+            ious.append(box_iou(ref[0], found[0]))
+        elif ref:
+            missed += 1
+        elif found:
+            extra += 1
+
+    return {
+        "frames": len(images),
+        "reference_faces": sum(1 for ref in reference if ref),
+        "matched": len(ious),
+        "missed": missed,
+        "extra": extra,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "min_iou": float(np.min(ious)) if ious else None,
+        "reference_seconds": reference_time,
+        "fast_seconds": fast_time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check downscaled face detection against full resolution detection.")
+    parser.add_argument("videos", nargs="+", help="videos to sample frames from")
+    parser.add_argument("--scale", type=float, default=0.5, help="detection scale factor")
+    parser.add_argument("--upsample", type=int, default=1, help="detector upsampling passes")
+    parser.add_argument("--fps", type=float, default=5)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    for video in args.videos:
+        images = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for _, frame in sample_frames(video, fps=args.fps, seconds=args.seconds)]
+        report = compare_detection(images, scale=args.scale, upsample=args.upsample)
+        mean_iou = "n/a" if report["mean_iou"] is None else f"{report['mean_iou']:.3f}"
+        min_iou = "n/a" if report["min_iou"] is None else f"{report['min_iou']:.3f}"
+        print(f"{video}: {report['matched']}/{report['reference_faces']} faces matched, "
+              f"{report['missed']} missed, {report['extra']} extra, "
+              f"IoU mean {mean_iou} min {min_iou}, "
+              f"{report['reference_seconds']:.2f}s -> {report['fast_seconds']:.2f}s")
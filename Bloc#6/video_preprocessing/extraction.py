@@ -0,0 +1,485 @@
+import argparse
+import json
+import os
+import time
+import shutil
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import cv2
+
+from detection import detect_faces
+from frames import sample_frames
+from instrumentation import StageStats, summarize
+from manifest import Manifest, file_digest, is_unchanged
+from pipeline import run_stages
+from postprocess import FACE_SIZE, crop_region, resize_blur
+from shards import ShardWriter
+from tracking import FaceTracker
+
+# minimum number of face frames for a video to be kept
+MIN_FACES = 10
+
+# face crops resized and blurred together, enough to amortise the batch blur while keeping memory flat
+RESIZE_CHUNK = 16
+
+# extraction parameters that do not change the extracted clips
+RUN_OPTIONS = ("debug", "pipeline", "detect_workers", "queue_size")
+
+
+def video_stem(videoName):
+    return os.path.splitext(videoName)[0]
+
+
+def list_videos(videoFolder):
+    #processes only video files
+    return sorted(name for name in os.listdir(videoFolder) if name.endswith(".mp4"))
+
+
+def output_folders(videoFolder, dataset):
+    """Return the output folder of each label for a dataset layout.
+
+    Celeb-DF folders hold a single class, so every video goes to `extracted`.
+    DFDC folders are split into `extracted_REAL` and `extracted_FAKE`.
+    """
+    if dataset == "celeb":
+        return {None: os.path.join(videoFolder, "extracted")}
+    if dataset == "dfdc":
+        return {
+            "REAL": os.path.join(videoFolder, "extracted_REAL"),
+            "FAKE": os.path.join(videoFolder, "extracted_FAKE"),
+        }
+    raise ValueError(f"Unknown dataset layout: {dataset}")
+
+
+def read_labels(videoFolder, dataset):
+    #dfdc folders must contain a metadata file with labels
+    if dataset != "dfdc":
+        return {}
+    metadata = pd.read_json(os.path.join(videoFolder, "metadata.json"))
+    return {name: metadata[name]['label'] for name in metadata.columns}
+
+
+class ClipWriter:
+    """Write face crops to a 1 fps AVI as they are extracted.
+
+    The clip is written next to `out_path` and renamed by `close(keep=True)`,
+    so an interrupted run leaves no partial clip; `close(keep=False)` drops it.
+    """
+
+    def __init__(self, out_path):
+        self.out_path = out_path
+        self.tmp_path = os.path.splitext(out_path)[0] + ".tmp.avi"
+        self.video = None
+
+    def write(self, face):
+        if self.video is None:
+            height, width, layers = face.shape
+            self.video = cv2.VideoWriter(self.tmp_path, 0, 1, (width,height))
+        #faces are RGB arrays, VideoWriter expects BGR frames
+        self.video.write(cv2.cvtColor(face, cv2.COLOR_RGB2BGR))
+
+    def close(self, keep=True):
+        if self.video is None:
+            return
+        self.video.release()
+        self.video = None
+        if keep:
+            os.replace(self.tmp_path, self.out_path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def sample_images(path, sub_path, fps=5, seconds=5, debug=False, stats=None):
+    #face recognition works on RGB images
+    videoName = os.path.basename(path)
+    for frameId, frame in sample_frames(path, fps=fps, seconds=seconds, stats=stats):
+        if debug:
+            with stats.stage("write"):
+                filename = video_stem(videoName) + str(int(frameId)) + ".jpg"
+                cv2.imwrite(os.path.join(sub_path, filename), frame) #create frame image
+        with stats.stage("decode"):
+            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        yield image
+
+
+def first_face(face_locations):
+    #get location of first face detected, sometimes other people are in frame or false faces are detected
+    return face_locations[0] if face_locations else None
+
+
+def extract_faces(path, sub_path, fps=5, seconds=5, debug=False,
+                  detect_scale=1.0, upsample=1, track=False, track_min_score=0.3,
+                  pipeline=False, detect_workers=2, queue_size=8, writer=None, max_faces=None, stats=None):
+    """Return the number of faces found in one video and the first `max_faces` of them.
+
+    Frames are sampled at `fps` over the first `seconds`, and the first
+    detected face of each frame is cropped with 10% padding clamped to the
+    frame. The crops are resized to 128x128 and blurred by chunks of
+    RESIZE_CHUNK (see postprocess.resize_blur), then passed in frame order
+    to `writer.write` when a writer is given. Only the first `max_faces` faces
+    (all of them by default) are kept and returned as a
+    `(n, 128, 128, 3)` RGB array, so with a writer and a small `max_faces`
+    memory does not grow with the length of the clip.
+    Frames stay in memory from decoding to the crops; with `debug` the
+    sampled frames and face crops are also saved to `sub_path` as JPEG and
+    PNG files. Faces are detected on frames resized by `detect_scale`. With
+    `track`, the face found on the first frame is followed through the clip
+    by a FaceTracker instead of running a full detection on every frame; a
+    detector score below `track_min_score` makes it detect the face again.
+
+    With `pipeline`, decoding, detection and cropping, and the resizing and
+    writing of the faces in frame order run as concurrent stages (see
+    pipeline.run_stages) with `detect_workers` detection threads, a
+    single one when tracking.
+    Stage times and counters are added to `stats` when a StageStats is given.
+    """
+    stats = stats if stats is not None else StageStats()
+    if debug:
+        os.makedirs(sub_path, exist_ok=True)
+
+    faces = []
+    crops = []
+    n_faces = 0
+
+    def flush():
+        nonlocal n_faces
+        if not crops:
+            return
+        #the variable-size crops are released as soon as they are resized
+        with stats.stage("crop"):
+            chunk = resize_blur(crops)
+        crops.clear()
+        with stats.stage("write"):
+            for face in chunk:
+                if debug:
+                    cv2.imwrite(os.path.join(sub_path, str(n_faces) + ".png"), cv2.cvtColor(face, cv2.COLOR_RGB2BGR))
+                if writer is not None:
+                    writer.write(face)
+                if max_faces is None or len(faces) < max_faces:
+                    faces.append(face)
+                n_faces += 1
+
+    def consume(crop):
+        #prevents code from breaking if no face is detected in frame
+        if crop is None:
+            stats.count("frames_no_face")
+            return
+        stats.count("faces_found")
+        crops.append(crop)
+        if len(crops) == RESIZE_CHUNK:
+            flush()
+
+    #by default we arbitrarily chose to extract 5 frames per second over the first 5 seconds
+    images = sample_images(path, sub_path, fps=fps, seconds=seconds, debug=debug, stats=stats)
+    if track:
+        tracker = FaceTracker(scale=detect_scale, upsample=upsample, min_score=track_min_score)
+        locate = tracker.update
+    else:
+        locate = lambda image: first_face(detect_faces(image, scale=detect_scale, upsample=upsample))
+
+    def crop(image, location):
+        if location is None:
+            return None
+        with stats.stage("crop"):
+            return crop_region(image, location)
+
+    def process(image):
+        with stats.stage("detect"):
+            location = locate(image)
+        return crop(image, location)
+
+    if pipeline:
+        run_stages(images, process, consume, detect_workers=1 if track else detect_workers, queue_size=queue_size)
+    else:
+        for image in images:
+            consume(process(image))
+    flush()
+
+    if track:
+        stats.count("full_detections", tracker.full_detections)
+        stats.count("region_detections", tracker.region_detections)
+
+    return n_faces, np.array(faces, dtype=np.uint8).reshape(-1, FACE_SIZE, FACE_SIZE, 3)
+
+
+def extract_video(path, out_path, sub_path, **params):
+    """Extract the face clip of one video.
+
+    The faces of `extract_faces` are written to `out_path` as a 1 fps AVI as
+    they are found, without keeping them in memory, and the clip is kept
+    when more than MIN_FACES frames have a face. Returns the number of face
+    frames found.
+    """
+    stats = params.get("stats") or StageStats()
+    params["stats"] = stats
+    writer = ClipWriter(out_path)
+    try:
+        n_faces, _ = extract_faces(path, sub_path, writer=writer, max_faces=0, **params)
+    except BaseException:
+        writer.close(keep=False)
+        raise
+    #check that at least 10 frames have been extracted
+    with stats.stage("write"):
+        writer.close(keep=n_faces>MIN_FACES)
+
+    return n_faces
+
+
+def _init_worker():
+    # one process per core already, keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+
+
+def remove_outputs(*paths):
+    #clear the outputs of a previous, possibly interrupted, extraction
+    for path in paths:
+        if path is None:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def _run_task(task, params, key, output="avi"):
+    #failures are reported per video instead of stopping the whole run
+    videoName, path, out_path, sub_path, label, previous = task
+    result = dict(video=videoName, status="failed", faces=0, error=None, sha1=None, clip=None, stats=None)
+    stats = StageStats()
+    start = time.time()
+    try:
+        result["sha1"] = file_digest(path)
+        if is_unchanged(previous, result["sha1"], key):
+            #the video was only touched since its last extraction
+            result.update(status="unchanged", faces=previous.get("faces", 0))
+        elif output == "shards":
+            remove_outputs(sub_path)
+            #only the frames of a shard clip are kept
+            n_faces, faces = extract_faces(path, sub_path, max_faces=key["clip_frames"], stats=stats, **params)
+            result["faces"] = n_faces
+            if n_faces > MIN_FACES:
+                result["clip"] = faces
+        else:
+            remove_outputs(out_path, sub_path, previous and previous.get("output"))
+            result["faces"] = extract_video(path, out_path, sub_path, stats=stats, **params)
+    except Exception:
+        result["error"] = traceback.format_exc()
+    else:
+        if result["status"] != "unchanged":
+            result["status"] = "done" if result["faces"] > MIN_FACES else "too_few_faces"
+    if result["status"] != "unchanged":
+        result["stats"] = stats.as_dict()
+    result["seconds"] = time.time() - start
+    return result
+
+
+def manifest_params(params, output="avi", clip_frames=None):
+    #parameters that change the extracted clips
+    key = {name: value for name, value in params.items() if name not in RUN_OPTIONS}
+    if not key.get("track"):
+        key.pop("track_min_score", None)
+    key["output"] = output
+    if output == "shards":
+        key["clip_frames"] = clip_frames
+    return key
+
+
+def build_tasks(videoFolder, dataset="celeb", output="avi", label=None):
+    labels = read_labels(videoFolder, dataset)
+    if output == "shards":
+        #every video of a celeb folder gets the label given on the command line
+        folders = {name: None for name in ("REAL", "FAKE")}
+        if dataset == "celeb" and label not in folders:
+            raise ValueError("Writing a Celeb-DF folder to shards needs its label, REAL or FAKE")
+    else:
+        folders = output_folders(videoFolder, dataset)
+        for folder in folders.values():
+            os.makedirs(folder, exist_ok=True)
+
+    tasks = []
+    for videoName in list_videos(videoFolder):
+        stem = video_stem(videoName)
+        if dataset == "dfdc":
+            video_label = labels.get(videoName)
+        else:
+            #the label only names the clips of the shards, an AVI celeb folder has a single output folder
+            video_label = label if output == "shards" else None
+        if video_label not in folders:
+            print(f"Skipping {videoName}: no label in metadata.json")
+            continue
+        out_folder = folders[video_label]
+        tasks.append((
+            videoName,
+            os.path.join(videoFolder, videoName),
+            out_folder and os.path.join(out_folder, stem + "_extracted.avi"),
+            os.path.join(videoFolder, stem),
+            video_label,
+        ))
+    return tasks
+
+
+def extract_folder(videoFolder, dataset="celeb", workers=None, fps=5, seconds=5, debug=False,
+                   detect_scale=1.0, upsample=1, track=False, track_min_score=0.3, force=False,
+                   output="avi", shard_dir=None, label=None, clip_frames=20, shard_size=256,
+                   pipeline=False, detect_workers=2, queue_size=8, stats_path=None):
+    """Extract every video of a folder over a pool of `workers` processes.
+
+    `fps` and `seconds` set the frame sampling rate and window, `debug` keeps
+    the sampled frames and face crops in a subfolder per video. `detect_scale`,
+    `upsample`, `track` and `track_min_score` set the face detection mode, and
+    `pipeline`, `detect_workers` and `queue_size` run the stages of each
+    video concurrently (see extract_faces).
+
+    With `output="avi"` the clips are written as AVI files in the extracted
+    folders of the dataset layout. With `output="shards"` they are written as
+    fixed-shape `(clip_frames, 128, 128, 3)` arrays in the memory-mapped
+    shards of `shard_dir` (see shards.ShardWriter); DFDC labels come from
+    metadata.json and a Celeb-DF folder needs its `label`, REAL or FAKE.
+
+    Progress is recorded in `manifest.jsonl` in the video folder. Videos that
+    were already extracted with the same parameters and whose content has not
+    changed are skipped, unless `force` is set; changed or failed videos are
+    extracted again after their previous outputs are removed.
+
+    A summary of the run with the time spent in each stage, the frame and
+    face counters and the per-video results is written as JSON to
+    `stats_path`, by default `extraction_stats.json` in the video folder.
+
+    Returns a dict mapping each video name to its status
+    (`done`, `too_few_faces`, `failed` or `skipped`).
+    """
+    tasks = build_tasks(videoFolder, dataset, output, label)
+    params = dict(fps=fps, seconds=seconds, debug=debug,
+                  detect_scale=detect_scale, upsample=upsample,
+                  track=track, track_min_score=track_min_score,
+                  pipeline=pipeline, detect_workers=detect_workers, queue_size=queue_size)
+    key = manifest_params(params, output, clip_frames)
+    writer = None
+    if output == "shards":
+        writer = ShardWriter(shard_dir or os.path.join(videoFolder, "shards"), clip_frames=clip_frames, shard_size=shard_size)
+    manifest = Manifest(os.path.join(videoFolder, "manifest.jsonl"))
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    per_video = {}
+    failed = []
+
+    todo = []
+    for videoName, path, out_path, sub_path, video_label in tasks:
+        if not force and manifest.is_current(videoName, path, key):
+            results[videoName] = "skipped"
+        else:
+            previous = None if force else manifest.get(videoName)
+            todo.append((videoName, path, out_path, sub_path, video_label, previous))
+    total = len(todo)
+    start = time.time()
+
+    print(f"Extracting {total} videos from {videoFolder} with {workers} workers, {len(results)} already extracted")
+    tasks = {task[0]: task for task in todo}
+    run = partial(_run_task, params=params, key=key, output=output)
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(run, task): task[0] for task in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except BrokenProcessPool as error:
+                #a worker was killed (e.g. out of memory) or crashed in native code: every video it
+                #left unfinished fails and is extracted again by the next run
+                result = dict(video=futures[future], status="failed", faces=0, sha1=None, clip=None, stats=None,
+                              seconds=0.0, error=f"Worker process died: {error}")
+            videoName, status = result["video"], result["status"]
+            _, path, out_path, sub_path, video_label, previous = tasks[videoName]
+            if status == "unchanged":
+                #keep the previous outputs, only refresh size and modification time
+                manifest.record(videoName, path, result["sha1"], key, previous["status"],
+                                output=previous["output"], faces=result["faces"])
+                status = "skipped"
+            elif result["sha1"] is not None:
+                if result["clip"] is not None:
+                    out_path = writer.add(video_stem(videoName), video_label, result["clip"], source=path)
+                manifest.record(videoName, path, result["sha1"], key, status,
+                                output=out_path if status == "done" else None, faces=result["faces"])
+            results[videoName] = status
+            per_video[videoName] = dict(status=status, seconds=result["seconds"], faces=result["faces"], stats=result["stats"])
+            elapsed = time.time() - start
+            eta = elapsed / done * (total - done)
+            print(f"[{done}/{total}] {videoName}: {status}, {result['faces']} faces in {result['seconds']:.1f}s (elapsed {elapsed:.0f}s, eta {eta:.0f}s)")
+            if result["error"] is not None:
+                failed.append(videoName)
+                print(result["error"])
+        if writer is not None:
+            writer.close()
+
+    wall_seconds = time.time() - start
+    summary = summarize(per_video, wall_seconds, params={**params, **key, "workers": workers})
+    with open(stats_path or os.path.join(videoFolder, "extraction_stats.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"{total - len(failed)} videos processed, {len(failed)} failed in {wall_seconds:.0f}s")
+    stage_seconds = ", ".join(f"{name} {value:.1f}s" for name, value in summary["stage_seconds"].items())
+    print(f"Stage times: {stage_seconds}")
+    if failed:
+        print("Failed videos: " + ", ".join(sorted(failed)))
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract face clips from a folder of videos.")
+    parser.add_argument("videoFolder", help="folder containing the .mp4 videos")
+    parser.add_argument("--dataset", choices=["celeb", "dfdc"], default="celeb",
+                        help="celeb: single-class folder written to `extracted`; "
+                             "dfdc: labels read from metadata.json, written to `extracted_REAL`/`extracted_FAKE`")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--fps", type=float, default=5, help="sampled frames per second")
+    parser.add_argument("--seconds", type=float, default=5, help="length of the sampling window in seconds")
+    parser.add_argument("--debug", action="store_true",
+                        help="also save the sampled frames (.jpg) and face crops (.png) in a subfolder per video")
+    parser.add_argument("--detect-scale", type=float, default=1.0,
+                        help="resize frames by this factor before face detection, e.g. 0.5 (see detection.py to check accuracy)")
+    parser.add_argument("--upsample", type=int, default=1, help="face detector upsampling passes")
+    parser.add_argument("--track", action="store_true",
+                        help="detect the face on a keyframe and track it through the clip, "
+                             "re-detecting only when it is lost")
+    parser.add_argument("--track-min-score", type=float, default=0.3,
+                        help="detector score below which --track detects the face again on the whole frame")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="run decoding, face detection and writing of each video as concurrent stages; "
+                             "use fewer --workers to leave cores to the stage threads")
+    parser.add_argument("--detect-workers", type=int, default=2, help="detection threads per video with --pipeline")
+    parser.add_argument("--queue-size", type=int, default=8, help="frames buffered between stages with --pipeline")
+    parser.add_argument("--stats", default=None,
+                        help="JSON summary of the run (default: extraction_stats.json in the video folder)")
+    parser.add_argument("--force", action="store_true",
+                        help="extract every video again, even if manifest.jsonl records it as done")
+    parser.add_argument("--output", choices=["avi", "shards"], default="avi",
+                        help="avi: one 1 fps AVI per video in the extracted folders; "
+                             "shards: fixed-shape clips in memory-mapped NumPy shards with an index.csv")
+    parser.add_argument("--shard-dir", default=None, help="shard folder (default: `shards` in the video folder)")
+    parser.add_argument("--label", choices=["REAL", "FAKE"], default=None,
+                        help="label of a celeb folder written to shards")
+    parser.add_argument("--clip-frames", type=int, default=20, help="number of frames per clip in the shards")
+    parser.add_argument("--shard-size", type=int, default=256, help="number of clips per shard")
+    args = parser.parse_args(argv)
+    if args.output == "shards" and args.dataset == "celeb" and args.label is None:
+        parser.error("--label is required to write a celeb folder to shards")
+    if args.label is not None and args.output != "shards":
+        parser.error("--label only applies with --output shards")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    extract_folder(args.videoFolder, dataset=args.dataset, workers=args.workers,
+                   fps=args.fps, seconds=args.seconds, debug=args.debug,
+                   detect_scale=args.detect_scale, upsample=args.upsample,
+                   track=args.track, track_min_score=args.track_min_score, force=args.force,
+                   output=args.output, shard_dir=args.shard_dir, label=args.label,
+                   clip_frames=args.clip_frames, shard_size=args.shard_size,
+                   pipeline=args.pipeline, detect_workers=args.detect_workers, queue_size=args.queue_size,
+                   stats_path=args.stats)
+    print("All done")
@@ -0,0 +1,57 @@
+import math
+
+import cv2
+
+from instrumentation import StageStats
+
+
+def sampling_step(frameRate, fps):
+    #keep one frame every `step` frames, at least every frame for low frame rate videos
+    return max(1, math.floor(frameRate/fps))
+
+
+def sample_frames(path, fps=5, seconds=5, stats=None):
+    """Yield `(frameId, frame)` for the sampled frames of a video.
+
+    Frames are kept when `frameId % floor(frameRate/fps) == 0` and
+    `frameId <= frameRate*seconds`, as in the original extractors. Frames in
+    between are skipped with `grab()`, which does not convert them to BGR
+    images, and the video is closed as soon as the sampling window is over
+    instead of decoding it to the end.
+    Raises IOError when the video cannot be opened, so that a corrupt or
+    unreadable file is reported as failed rather than as a video without faces.
+    Opening and decoding times and the number of sampled frames are added
+    to `stats` when a StageStats is given.
+    """
+    stats = stats if stats is not None else StageStats()
+    with stats.stage("open"):
+        videocap = cv2.VideoCapture(path)
+        frameRate = videocap.get(cv2.CAP_PROP_FPS)
+        frameCount = videocap.get(cv2.CAP_PROP_FRAME_COUNT)
+    try:
+        if not videocap.isOpened() or not frameRate:
+            raise IOError(f"Cannot read video {path}")
+        step = sampling_step(frameRate, fps)
+        lastFrame = frameRate*seconds
+        if frameCount > 0:
+            lastFrame = min(lastFrame, frameCount - 1)
+
+        frameId = 0
+        while frameId <= lastFrame:
+            with stats.stage("decode"):
+                ret, frame = videocap.read()
+            if not ret:
+                break
+            stats.count("frames_sampled")
+            yield frameId, frame
+
+            #skip the frames until the next sampled one
+            frameId += step
+            if frameId > lastFrame:
+                break
+            with stats.stage("decode"):
+                grabbed = all(videocap.grab() for _ in range(step - 1))
+            if not grabbed:
+                break
+    finally:
+        videocap.release()
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# stages timed for every video, in pipeline order
+STAGES = ("open", "decode", "detect", "crop", "write")
+
+
+class StageStats:
+    """Time spent in each extraction stage and event counters of a video.
+
+    Stage times add up the time of every call of the stage, across threads
+    with the pipelined extraction, so they measure busy time rather than
+    wall time. Counters cover `frames_sampled`, `faces_found` and
+    `frames_no_face`, plus the tracker detections when tracking.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.seconds[name] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def as_dict(self):
+        return {
+            "seconds": {name: self.seconds.get(name, 0.0) for name in STAGES},
+            "counts": dict(self.counts),
+        }
+
+
+def summarize(videos, wall_seconds, params=None):
+    """Machine-readable summary of a run from the per-video results.
+
+    `videos` maps each video name to a dict with its `status`, `seconds` and
+    the `stats` of StageStats.as_dict() when it was extracted.
+    """
+    seconds = defaultdict(float)
+    counts = Counter()
+    statuses = Counter()
+    for result in videos.values():
+        statuses[result["status"]] += 1
+        stats = result.get("stats")
+        if stats:
+            for name, value in stats["seconds"].items():
+                seconds[name] += value
+            counts.update(stats["counts"])
+
+    extracted = statuses["done"] + statuses["too_few_faces"]
+    return {
+        "params": params or {},
+        "wall_seconds": wall_seconds,
+        "videos": len(videos),
+        "videos_extracted": extracted,
+        "statuses": dict(statuses),
+        "stage_seconds": {name: seconds.get(name, 0.0) for name in STAGES},
+        "counts": dict(counts),
+        "frames_per_second": counts["frames_sampled"] / wall_seconds if wall_seconds else None,
+        "videos_per_hour": extracted / wall_seconds * 3600 if wall_seconds else None,
+        "per_video": videos,
+    }
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+
+# statuses of videos that do not need to be extracted again
+FINISHED = ("done", "too_few_faces")
+
+# parameters recorded by older versions that never changed the extracted clips
+RETIRED_PARAMS = ("batch_detect",)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    #sha1 of the file content, read in chunks so large videos are not loaded in memory
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Record of the extraction status of each video of a folder.
+
+    Every entry holds the content hash, size and modification time of the
+    video, the extraction parameters, its status and its output file. The
+    manifest is an append-only JSON lines file, one line per finished video,
+    so a crash never loses more than the video being processed; the last line
+    of a video wins and the file is compacted when it is loaded.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue #line cut by a crash
+                    for name in RETIRED_PARAMS:
+                        entry["params"].pop(name, None)
+                    self.entries[entry["video"]] = entry
+            self.compact()
+
+    def compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def get(self, videoName):
+        return self.entries.get(videoName)
+
+    def is_current(self, videoName, path, params):
+        """True when the video was already extracted with `params` and has not changed since.
+
+        Size and modification time are compared instead of the content hash,
+        so that unchanged videos are skipped without being read again. Videos
+        that were only touched are hashed again by the worker, see `is_unchanged`.
+        """
+        entry = self.entries.get(videoName)
+        if entry is None or entry["status"] not in FINISHED or entry["params"] != params:
+            return False
+        stat = os.stat(path)
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def record(self, videoName, path, digest, params, status, output=None, **info):
+        stat = os.stat(path)
+        entry = dict(video=videoName, sha1=digest, size=stat.st_size, mtime=stat.st_mtime,
+                     params=params, status=status, output=output, **info)
+        self.entries[videoName] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return entry
+
+
+def is_unchanged(entry, digest, params):
+    #previous extraction of the same content with the same parameters
+    return (entry is not None and entry["status"] in FINISHED
+            and entry["sha1"] == digest and entry["params"] == params)
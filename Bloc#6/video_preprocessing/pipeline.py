@@ -0,0 +1,106 @@
+import queue
+import threading
+
+# marks the end of a stream in the queues
+_END = object()
+
+
+def _put(q, item, stop):
+    #blocking put that gives up when another stage failed
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_stages(images, process, consume, detect_workers=2, queue_size=8):
+    """Run decode, detection and writing of one video as concurrent stages.
+
+    A decoder thread pulls the frames from `images`, `detect_workers` threads
+    call `process(image)` on them (detection and crop), and a writer thread
+    calls `consume(result)` on the results in frame order. Stages are linked
+    by queues of `queue_size` items, and at most `queue_size + detect_workers`
+    frames are in flight between the decoder and the writer, so memory stays
+    flat on long clips whatever the speed of each stage. Decoding and
+    encoding release the GIL in OpenCV; the detection threads only run in
+    parallel with each other when the detector releases it too, so a single
+    worker is enough when `process` keeps state across frames.
+
+    The first exception raised by a stage stops the others and is raised
+    again in the calling thread.
+    """
+    frames = queue.Queue(queue_size)
+    results = queue.Queue(queue_size)
+    in_flight = threading.BoundedSemaphore(queue_size + detect_workers)
+    stop = threading.Event()
+    errors = []
+
+    def guarded(stage):
+        def run():
+            try:
+                stage()
+            except BaseException as error:
+                errors.append(error)
+                stop.set()
+        return run
+
+    def decode():
+        for i, image in enumerate(images):
+            while not in_flight.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            if not _put(frames, (i, image), stop):
+                return
+        for _ in range(detect_workers):
+            _put(frames, _END, stop)
+
+    def detect():
+        while True:
+            item = _get(frames, stop)
+            if item is _END:
+                break
+            i, image = item
+            if not _put(results, (i, process(image)), stop):
+                return
+        _put(results, _END, stop)
+
+    def write():
+        #results arrive out of order from the workers, hand them over in frame order
+        pending = {}
+        next_id = 0
+        running = detect_workers
+        while running:
+            item = _get(results, stop)
+            if item is _END:
+                if stop.is_set():
+                    return
+                running -= 1
+                continue
+            i, result = item
+            pending[i] = result
+            while next_id in pending:
+                consume(pending.pop(next_id))
+                next_id += 1
+                in_flight.release()
+
+    threads = [threading.Thread(target=guarded(decode), name="decode")]
+    threads += [threading.Thread(target=guarded(detect), name=f"detect-{n}") for n in range(detect_workers)]
+    threads.append(threading.Thread(target=guarded(write), name="write"))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
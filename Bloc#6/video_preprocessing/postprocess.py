@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+# size of the face crops fed to the model
+FACE_SIZE = 128
+
+
+def padded_box(location, shape, pad_ratio=0.1):
+    """Return the `(top, bottom, left, right)` crop of a face box with padding, clamped to the frame.
+
+    The padding is `pad_ratio` times the face height on every side, as in the
+    original extractors, but it stops at the frame border instead of falling
+    back to the unpadded box.
+    """
+    top, right, bottom, left = location
+    height, width = shape[:2]
+    pad = int((bottom-top)*pad_ratio)
+    return max(top - pad, 0), min(bottom + pad, height), max(left - pad, 0), min(right + pad, width)
+
+
+def crop_region(image, location, pad_ratio=0.1):
+    #copy the padded face so the full frame can be released
+    top, bottom, left, right = padded_box(location, image.shape, pad_ratio)
+    return image[top:bottom, left:right].copy()
+
+
+def gaussian_blur_batch(faces, sigma=0.5):
+    """Blur a `(n, height, width, channels)` batch of images in one pass.
+
+    The separable 3-tap Gaussian kernel of `sigma` is applied to the whole
+    batch at once along the height and width axes, with the borders of each
+    image replicated. For the small radius used here it stays within a few
+    grey levels of PIL's `GaussianBlur(radius=sigma)`.
+    """
+    k = cv2.getGaussianKernel(3, sigma).ravel().astype(np.float32)
+    padded = np.pad(faces.astype(np.float32), ((0, 0), (1, 1), (1, 1), (0, 0)), mode="edge")
+    rows = k[0] * padded[:, :-2] + k[1] * padded[:, 1:-1] + k[2] * padded[:, 2:]
+    out = k[0] * rows[:, :, :-2] + k[1] * rows[:, :, 1:-1] + k[2] * rows[:, :, 2:]
+    return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+
+def resize_blur(crops, size=FACE_SIZE, sigma=0.5):
+    """Resize face crops of any size to `size` x `size` and blur them as one batch.
+
+    Returns a contiguous `(n, size, size, 3)` uint8 array.
+    """
+    faces = np.empty((len(crops), size, size, 3), dtype=np.uint8)
+    for i, crop in enumerate(crops):
+        #area interpolation when shrinking, like PIL's antialiased resize
+        interpolation = cv2.INTER_AREA if crop.shape[0] > size else cv2.INTER_CUBIC
+        cv2.resize(crop, (size, size), dst=faces[i], interpolation=interpolation)
+    if len(crops):
+        faces = gaussian_blur_batch(faces, sigma)
+    return faces
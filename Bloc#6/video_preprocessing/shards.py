@@ -0,0 +1,131 @@
+import csv
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+LABELS = {"REAL": 0, "FAKE": 1}
+INDEX_COLUMNS = ["clip", "label", "label_id", "shard", "offset", "frames", "source"]
+SHARD_NAME = re.compile(r"shard_(\d+)\.npy")
+
+
+def to_clip(faces, clip_frames, size=128):
+    """Stack face crops into a fixed `(clip_frames, size, size, 3)` uint8 clip.
+
+    Longer clips are cut, shorter ones are padded with black frames. Returns
+    the clip and the number of real frames in it.
+    """
+    clip = np.zeros((clip_frames, size, size, 3), dtype=np.uint8)
+    n = min(len(faces), clip_frames)
+    if n:
+        clip[:n] = np.asarray(faces[:n], dtype=np.uint8)
+    return clip, n
+
+
+class ShardWriter:
+    """Write face clips into memory-mapped NumPy shards.
+
+    Each shard `shard_XXXXX.npy` holds up to `shard_size` clips of shape
+    `(clip_frames, size, size, 3)`. `index.csv` has one line per clip with
+    its label, shard and offset in the shard. Runs append to the existing
+    shards of the folder, so the Celeb-DF real and fake folders and the DFDC
+    sample can be written to the same dataset; when the video of a clip (same
+    folder and name) is written again, the last line of the index is the
+    valid one.
+    """
+
+    def __init__(self, folder, clip_frames=20, shard_size=256, size=128):
+        self.folder = folder
+        self.clip_frames = clip_frames
+        self.shard_size = shard_size
+        self.size = size
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, "index.csv")
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, "w", newline="") as f:
+                csv.writer(f).writerow(INDEX_COLUMNS)
+        #leftovers of an interrupted run do not match the shard names
+        ids = [int(match.group(1)) for match in map(SHARD_NAME.fullmatch, os.listdir(folder)) if match]
+        self.shard_id = max(ids) + 1 if ids else 0
+        self.shard = None
+        self.count = 0
+
+    def _open_shard(self):
+        self.shard_name = f"shard_{self.shard_id:05d}.npy"
+        shape = (self.shard_size, self.clip_frames, self.size, self.size, 3)
+        self.shard = np.lib.format.open_memmap(os.path.join(self.folder, self.shard_name),
+                                               mode="w+", dtype=np.uint8, shape=shape)
+        self.count = 0
+
+    def _close_shard(self):
+        path = os.path.join(self.folder, self.shard_name)
+        self.shard.flush()
+        if self.count < self.shard_size:
+            #shrink the last shard to the clips it holds, offsets are unchanged
+            tmp_path = path + ".part"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.shard[:self.count])
+            del self.shard
+            os.replace(tmp_path, path)
+        self.shard = None
+        self.shard_id += 1
+
+    def add(self, clip_name, label, faces, source=""):
+        """Write the faces of a clip and return its location as `shard:offset`."""
+        if label not in LABELS:
+            raise ValueError(f"Unknown label {label}, expected one of {list(LABELS)}")
+        if self.shard is None:
+            self._open_shard()
+        clip, n = to_clip(faces, self.clip_frames, self.size)
+        offset = self.count
+        self.shard[offset] = clip
+        self.shard.flush()
+        self.count += 1
+        with open(self.index_path, "a", newline="") as f:
+            csv.writer(f).writerow([clip_name, label, LABELS[label], self.shard_name, offset, n, source])
+        if self.count == self.shard_size:
+            self._close_shard()
+        return f"{self.shard_name}:{offset}"
+
+    def close(self):
+        if self.shard is not None:
+            self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardDataset:
+    """Read the clips of a shard folder without copying them.
+
+    `dataset[i]` returns a read-only `(clip_frames, 128, 128, 3)` view into
+    the memory-mapped shard and the label id (0 for REAL, 1 for FAKE).
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        index = pd.read_csv(os.path.join(folder, "index.csv"), keep_default_na=False)
+        #a clip is identified by its video and the folder of the video, e.g. real/001.mp4 and fake/001.mp4
+        folders = index["source"].map(lambda source: os.path.basename(os.path.dirname(os.path.abspath(source))) if source else "")
+        self.index = index[~pd.concat([folders, index["clip"]], axis=1).duplicated(keep="last")].reset_index(drop=True)
+        self._shards = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def shard(self, name):
+        if name not in self._shards:
+            self._shards[name] = np.load(os.path.join(self.folder, name), mmap_mode="r")
+        return self._shards[name]
+
+    def __getitem__(self, i):
+        row = self.index.iloc[i]
+        return self.shard(row["shard"])[row["offset"]], int(row["label_id"])
+
+    @property
+    def labels(self):
+        return self.index["label_id"].to_numpy()
@@ -0,0 +1,108 @@
+from detection import box_iou, detect_with_scores
+
+
+def expand_box(location, margin, shape):
+    #grow the box by `margin` times its size on every side, clamped to the image
+    top, right, bottom, left = location
+    height, width = shape[:2]
+    dy = int((bottom - top) * margin)
+    dx = int((right - left) * margin)
+    return max(top - dy, 0), min(right + dx, width), min(bottom + dy, height), max(left - dx, 0)
+
+
+def box_distance(a, b):
+    #distance between box centres, relative to the size of box `a`
+    size = max(a[2] - a[0], a[1] - a[3], 1)
+    dy = (a[0] + a[2]) / 2 - (b[0] + b[2]) / 2
+    dx = (a[1] + a[3]) / 2 - (b[1] + b[3]) / 2
+    return (dx ** 2 + dy ** 2) ** 0.5 / size
+
+
+class FaceTracker:
+    """Follow one face across the sampled frames of a clip.
+
+    The first full detection picks the first face found, as the extractors
+    did with `face_locations[0]`. On the next frames the detector only
+    searches a region `margin` times the face size around the last box. A
+    full-frame detection runs again when the face is not found in that
+    region, when its detector score drops below `min_score`, when it overlaps
+    the last box by less than `min_iou`, and at least every `redetect_every`
+    frames. Scores are on the scale of dlib's HOG detector, which only returns
+    faces scoring above 0; around 0.3 and below they are mostly partial or
+    blurred faces. Full detections accept any face the detector returns, as
+    face_locations does. Re-detections keep the face closest to the last box,
+    so the same person is followed through the clip; a face further than
+    `max_jump` face sizes away counts as lost. After `max_lost` frames in a
+    row without the face, the track is reset and the next detection picks a
+    new face.
+    """
+
+    def __init__(self, scale=1.0, upsample=1, margin=0.5, min_score=0.3, min_iou=0.3,
+                 redetect_every=10, max_jump=1.0, max_lost=3):
+        self.scale = scale
+        self.upsample = upsample
+        self.margin = margin
+        self.min_score = min_score
+        self.min_iou = min_iou
+        self.redetect_every = redetect_every
+        self.max_jump = max_jump
+        self.max_lost = max_lost
+
+        self.box = None
+        self.since_detect = 0
+        self.lost = 0
+        #counters of how the face was located
+        self.full_detections = 0
+        self.region_detections = 0
+        self.lost_frames = 0
+
+    def reset(self):
+        self.box = None
+        self.since_detect = 0
+        self.lost = 0
+
+    def search_region(self, image):
+        #detect in the region around the last box only, at full resolution since the region is small
+        top, right, bottom, left = expand_box(self.box, self.margin, image.shape)
+        self.region_detections += 1
+        found = detect_with_scores(image[top:bottom, left:right], upsample=self.upsample)
+        for (t, r, b, l), score in found:
+            location = (t + top, r + left, b + top, l + left)
+            if score >= self.min_score and box_iou(location, self.box) >= self.min_iou:
+                return location
+        return None
+
+    def detect(self, image):
+        self.full_detections += 1
+        found = [location for location, score in detect_with_scores(image, scale=self.scale, upsample=self.upsample)]
+        if not found:
+            return None
+        if self.box is None:
+            #new track, keep the first face as the extractors did
+            return found[0]
+        location = min(found, key=lambda location: box_distance(self.box, location))
+        if box_distance(self.box, location) > self.max_jump:
+            return None
+        return location
+
+    def update(self, image):
+        """Return the location of the tracked face in an RGB frame, or None if it is not found."""
+        location = None
+        if self.box is not None and self.since_detect < self.redetect_every:
+            location = self.search_region(image)
+            if location is not None:
+                self.since_detect += 1
+        if location is None:
+            location = self.detect(image)
+            self.since_detect = 0
+
+        if location is None:
+            self.lost_frames += 1
+            self.lost += 1
+            if self.lost >= self.max_lost:
+                self.reset()
+            return None
+
+        self.box = location
+        self.lost = 0
+        return location